@@ -0,0 +1,32 @@
+"""add receipts analytics indexes
+
+Revision ID: a3c9e4f1b2d7
+Revises: 56720fc99c3d
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c9e4f1b2d7'
+down_revision: Union[str, Sequence[str], None] = '56720fc99c3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_receipts_user_status_pdt', 'receipts', ['user_id', 'status', 'purchase_datetime'], unique=False)
+    op.create_index('ix_receipts_user_merchant', 'receipts', ['user_id', 'merchant'], unique=False)
+    op.create_index('ix_receipts_user_total_usd', 'receipts', ['user_id', 'total_usd'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_receipts_user_total_usd', table_name='receipts')
+    op.drop_index('ix_receipts_user_merchant', table_name='receipts')
+    op.drop_index('ix_receipts_user_status_pdt', table_name='receipts')
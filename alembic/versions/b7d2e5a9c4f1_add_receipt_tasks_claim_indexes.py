@@ -0,0 +1,33 @@
+"""add receipt_tasks claim indexes
+
+Revision ID: b7d2e5a9c4f1
+Revises: a3c9e4f1b2d7
+Create Date: 2026-10-15 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2e5a9c4f1'
+down_revision: Union[str, Sequence[str], None] = 'a3c9e4f1b2d7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    active = sa.text("status IN ('queued', 'processing')")
+    op.create_index('ix_tasks_claim', 'receipt_tasks', ['status', 'run_after', 'created_at'], unique=False, postgresql_where=active)
+    op.create_index('ix_tasks_stale', 'receipt_tasks', ['status', 'locked_at'], unique=False, postgresql_where=active)
+    op.drop_index(op.f('ix_receipt_tasks_status'), table_name='receipt_tasks')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_receipt_tasks_status'), 'receipt_tasks', ['status'], unique=False)
+    op.drop_index('ix_tasks_stale', table_name='receipt_tasks')
+    op.drop_index('ix_tasks_claim', table_name='receipt_tasks')
@@ -0,0 +1,51 @@
+"""store raw_llm_json as JSON
+
+Revision ID: c4e8a1d6f3b2
+Revises: b7d2e5a9c4f1
+Create Date: 2026-10-15 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a1d6f3b2'
+down_revision: Union[str, Sequence[str], None] = 'b7d2e5a9c4f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.alter_column(
+            'receipts', 'raw_llm_json',
+            existing_type=sa.Text(), type_=postgresql.JSONB(), existing_nullable=True,
+            postgresql_using='raw_llm_json::jsonb',
+        )
+        return
+
+    with op.batch_alter_table('receipts') as batch_op:
+        batch_op.alter_column('raw_llm_json', existing_type=sa.Text(), type_=sa.JSON(), existing_nullable=True)
+    if dialect == 'sqlite':
+        # existing rows were written with indent=2
+        op.execute("UPDATE receipts SET raw_llm_json = json(raw_llm_json) WHERE raw_llm_json IS NOT NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column(
+            'receipts', 'raw_llm_json',
+            existing_type=postgresql.JSONB(), type_=sa.Text(), existing_nullable=True,
+            postgresql_using='raw_llm_json::text',
+        )
+        return
+
+    with op.batch_alter_table('receipts') as batch_op:
+        batch_op.alter_column('raw_llm_json', existing_type=sa.JSON(), type_=sa.Text(), existing_nullable=True)
@@ -0,0 +1,45 @@
+"""compute receipts.total_usd from fx_rate
+
+Revision ID: d5f1b8c2e7a4
+Revises: c4e8a1d6f3b2
+Create Date: 2026-10-15 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f1b8c2e7a4'
+down_revision: Union[str, Sequence[str], None] = 'c4e8a1d6f3b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index('ix_receipts_user_total_usd', table_name='receipts')
+    op.add_column('receipts', sa.Column('fx_rate', sa.Float(), nullable=True))
+    # recover the rate each processed receipt was converted with
+    op.execute(
+        "UPDATE receipts SET fx_rate = CASE WHEN total <> 0 THEN total_usd / total ELSE 1.0 END "
+        "WHERE total_usd IS NOT NULL"
+    )
+    # a column can't be turned into a generated one in place: drop and re-add
+    with op.batch_alter_table('receipts') as batch_op:
+        batch_op.drop_column('total_usd')
+        batch_op.add_column(sa.Column('total_usd', sa.Float(), sa.Computed('total * fx_rate', persisted=True)))
+    op.create_index('ix_receipts_user_total_usd', 'receipts', ['user_id', 'total_usd'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_receipts_user_total_usd', table_name='receipts')
+    with op.batch_alter_table('receipts') as batch_op:
+        batch_op.drop_column('total_usd')
+        batch_op.add_column(sa.Column('total_usd', sa.Float(), nullable=True))
+    op.execute("UPDATE receipts SET total_usd = total * fx_rate")
+    op.drop_column('receipts', 'fx_rate')
+    op.create_index('ix_receipts_user_total_usd', 'receipts', ['user_id', 'total_usd'], unique=False)
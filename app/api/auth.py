@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
 from app.core.security import create_access_token, hash_password, verify_password
@@ -11,22 +13,26 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 
 
 @router.post("/register", response_model=dict)
-def register(payload: UserCreate, db: Session = Depends(get_db)):
-    exists = db.query(User).filter(User.username == payload.username).first()
+async def register(payload: UserCreate, db: AsyncSession = Depends(get_db)):
+    exists = await db.scalar(select(User).where(User.username == payload.username))
     if exists:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    user = User(username=payload.username, password_hash=hash_password(payload.password))
+    # argon2 is CPU-bound: keep it off the event loop
+    password_hash = await run_in_threadpool(hash_password, payload.password)
+
+    user = User(username=payload.username, password_hash=password_hash)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return {"id": user.id, "username": user.username}
 
 
 @router.post("/login", response_model=Token)
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form.username).first()
-    if not user or not verify_password(form.password, user.password_hash):
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == form.username))
+    password_hash = user.password_hash if user else None
+    if not await run_in_threadpool(verify_password, form.password, password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
 
     token = create_access_token(subject=user.username)
@@ -1,43 +1,68 @@
 from __future__ import annotations
 
+import csv
+import hashlib
+import io
+import json
 import re
 from datetime import datetime, timezone
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, AsyncGenerator, AsyncIterator, Callable
+from uuid import uuid4
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
+from redis.exceptions import RedisError
 from sqlalchemy import text as sql_text
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from collections import deque
-from app.models.chat_query import ChatQuery
-
-
-from openai import OpenAI
 
 import time
 
 from app.api.deps import get_current_user, get_db
+from app.core.cache import cache_get, cache_set, redis_client
 from app.core.config import settings
+from app.core.openai_client import get_interactive_client, openai_limiter
 from app.models.user import User
+from app.services.chat_log import log_chat_query
 from app.services.sql_sandbox import sanitize_sql, SQLSandboxError
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-# ---- canned intents cache (in-memory, TTL) ----
+# ---- canned intents cache (Redis, TTL) ----
 _CANNED_CACHE_TTL_SECONDS = 600  # 10 minutes
 
-# key -> (expires_at, value)
-# value = {"answer": str, "sql": str, "table": {"columns": [...], "rows": [[...], ...]}}
-_CANNED_CACHE: dict[tuple, tuple[float, dict]] = {}
+# ---- summarizer answers keyed by (question, table) ----
+_SUMMARY_CACHE_TTL_SECONDS = 3600
 
-# ---- rate limit (in-memory) ----
+# ---- rate limit (Redis sliding window) ----
 _RATE_LIMIT_PER_MIN = 20  # requests per minute per user
-_RATE_BUCKET: dict[int, deque[float]] = {}  # user_id -> timestamps
+_RATE_WINDOW_MS = 60_000
+
+# atomically: drop entries older than the window, count, admit if below limit
+_RATE_LIMIT_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+if redis.call('ZCARD', key) >= limit then
+  return 0
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('PEXPIRE', key, window)
+return 1
+"""
+_rate_limit_script = redis_client.register_script(_RATE_LIMIT_LUA) if redis_client is not None else None
 
+# fallback when Redis is not configured: user_id -> timestamps
+_RATE_BUCKET: dict[int, deque[float]] = {}
 
-def _rate_limit(user_id: int) -> None:
+
+def _rate_limit_local(user_id: int) -> bool:
     now = time.time()
     q = _RATE_BUCKET.get(user_id)
     if q is None:
@@ -45,53 +70,63 @@ def _rate_limit(user_id: int) -> None:
         _RATE_BUCKET[user_id] = q
 
     # drop older than 60s
-    cutoff = now - 60.0
+    cutoff = now - _RATE_WINDOW_MS / 1000
     while q and q[0] < cutoff:
         q.popleft()
 
     if len(q) >= _RATE_LIMIT_PER_MIN:
-        raise HTTPException(status_code=429, detail="Rate limit exceeded (per minute)")
+        return False
 
     q.append(now)
+    return True
+
+
+async def _rate_limit(user_id: int) -> None:
+    if _rate_limit_script is None:
+        allowed = _rate_limit_local(user_id)
+    else:
+        try:
+            allowed = await _rate_limit_script(
+                keys=[f"chat:rate:{user_id}"],
+                args=[int(time.time() * 1000), _RATE_WINDOW_MS, _RATE_LIMIT_PER_MIN, uuid4().hex],
+            )
+        except RedisError:
+            # Redis is down: limit per process instead of failing every chat request
+            allowed = _rate_limit_local(user_id)
+    if not allowed:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded (per minute)")
+
+
+_CURRENCY_RE = re.compile(r"(?P<RUB>руб|rub)|(?P<EUR>евро|eur)|(?P<CHF>франк|chf)", re.IGNORECASE)
 
 
 def _detect_target_currency(question: str) -> str:
-    q = question.lower()
-    if "руб" in q or " rub" in q or "rub" in q:
-        return "RUB"
-    if "евро" in q or " eur" in q or "eur" in q:
-        return "EUR"
-    if "франк" in q or " chf" in q or "chf" in q:
-        return "CHF"
+    # one pass over the question; RUB > EUR > CHF when several are mentioned
+    found = {m.lastgroup for m in _CURRENCY_RE.finditer(question)}
+    for cur in ("RUB", "EUR", "CHF"):
+        if cur in found:
+            return cur
     return "USD"
 
 
-def _cache_get(key: tuple) -> dict | None:
-    item = _CANNED_CACHE.get(key)
-    if not item:
-        return None
-    expires_at, value = item
-    if expires_at < time.time():
-        _CANNED_CACHE.pop(key, None)
-        return None
-    return value
+def _canned_cache_key(user_id: int, intent: str, params: dict[str, Any]) -> str:
+    # stable across processes (unlike hash())
+    params_key = json.dumps(sorted((k, str(v)) for k, v in params.items()))
+    digest = hashlib.sha1(params_key.encode("utf-8")).hexdigest()
+    return f"chat:canned:{user_id}:{intent}:{digest}"
 
 
-def _cache_set(key: tuple, value: dict) -> None:
-    _CANNED_CACHE[key] = (time.time() + _CANNED_CACHE_TTL_SECONDS, value)
+def _summary_cache_key(question: str, columns: list[str], rows: list[list[Any]]) -> str:
+    # same normalised question over the same table -> same answer
+    q = " ".join(question.lower().split())
+    body = json.dumps([q, columns, rows[:30], len(rows)], ensure_ascii=False, default=str)
+    return f"chat:sum:{hashlib.blake2b(body.encode('utf-8'), digest_size=20).hexdigest()}"
 
 
 class ChatRequest(BaseModel):
     question: str = Field(min_length=1, max_length=2000)
 
 
-class ChatResponse(BaseModel):
-    answer: str
-    sql: str | None = None
-    source: str  # canned | llm
-    table: dict | None = None  # {"columns":[...], "rows":[[...], ...]}
-
-
 # --------- intent router (canned) ----------
 
 @dataclass(frozen=True)
@@ -121,71 +156,112 @@ def _last_month_range(now: datetime) -> tuple[str, str]:
     return _month_range(last)
 
 
-def _route_canned(question: str) -> RoutedQuery | None:
-    q = question.strip().lower()
+def _canned_total_this_month() -> RoutedQuery:
+    start, end = _month_range(datetime.now(timezone.utc))
+    return RoutedQuery(
+        sql="""
+        SELECT COALESCE(SUM(total_usd), 0) AS total_spent
+        FROM receipts
+        WHERE receipts.user_id = :uid AND receipts.status = 'done'
+        AND purchase_datetime >= :start AND purchase_datetime < :end
 
-    # total this month
-    if re.search(r"\b(total|sum)\b.*\b(this month|current month)\b", q) or re.search(r"\bspent\b.*\bthis month\b", q):
-        start, end = _month_range(datetime.now(timezone.utc))
-        return RoutedQuery(
-            sql="""
-            SELECT COALESCE(SUM(total_usd), 0) AS total_spent
-            FROM receipts
-            WHERE purchase_datetime >= :start AND purchase_datetime < :end
-            AND receipts.status = 'done'
-
-            """,
-            params={"start": start, "end": end},
-            source="canned",
-            intent="total_this_month",
-        )
+        """,
+        params={"start": start, "end": end},
+        source="canned",
+        intent="total_this_month",
+    )
 
-    # total last month
-    if re.search(r"\b(total|sum)\b.*\blast month\b", q) or re.search(r"\bspent\b.*\blast month\b", q):
-        start, end = _last_month_range(datetime.now(timezone.utc))
-        return RoutedQuery(
-            sql="""
-            SELECT COALESCE(SUM(total_usd), 0) AS total_spent
-            FROM receipts
-            WHERE purchase_datetime >= :start AND purchase_datetime < :end
-            AND receipts.status = 'done'
-
-            """,
-            params={"start": start, "end": end},
-            source="canned",
-            intent="total_last_month",
-        )
 
-    # top merchants
-    if re.search(r"\b(top|most)\b.*\b(merchant|store|shops?)\b", q):
-        return RoutedQuery(
-            sql="""
-            SELECT merchant, COUNT(*) AS receipts_count, COALESCE(SUM(total_usd),0) AS total_spent
-            FROM receipts
-            WHERE merchant IS NOT NULL
-            GROUP BY merchant
-            ORDER BY total_spent DESC
-            LIMIT 10
-            """,
-            params={},
-            source="canned",
-            intent="top_merchants",
-        )
+def _canned_total_last_month() -> RoutedQuery:
+    start, end = _last_month_range(datetime.now(timezone.utc))
+    return RoutedQuery(
+        sql="""
+        SELECT COALESCE(SUM(total_usd), 0) AS total_spent
+        FROM receipts
+        WHERE receipts.user_id = :uid AND receipts.status = 'done'
+        AND purchase_datetime >= :start AND purchase_datetime < :end
 
-    # most expensive receipt
-    if re.search(r"\b(most expensive|largest|biggest)\b", q):
-        return RoutedQuery(
-            sql="""
-            SELECT id, merchant, purchase_datetime, total_usd, currency
-            FROM receipts
-            WHERE total_usd IS NOT NULL
-            ORDER BY total_usd DESC
-            LIMIT 1
-            """,
-            params={},
-            source="canned",
-            total="most_expensive_receipt"
-        )
+        """,
+        params={"start": start, "end": end},
+        source="canned",
+        intent="total_last_month",
+    )
+
+
+def _canned_top_merchants() -> RoutedQuery:
+    return RoutedQuery(
+        sql="""
+        SELECT merchant, COUNT(*) AS receipts_count, COALESCE(SUM(total_usd),0) AS total_spent
+        FROM receipts
+        WHERE receipts.user_id = :uid AND merchant IS NOT NULL
+        GROUP BY merchant
+        ORDER BY total_spent DESC
+        LIMIT 10
+        """,
+        params={},
+        source="canned",
+        intent="top_merchants",
+    )
+
+
+def _canned_most_expensive() -> RoutedQuery:
+    return RoutedQuery(
+        sql="""
+        SELECT id, merchant, purchase_datetime, total_usd, currency
+        FROM receipts
+        WHERE receipts.user_id = :uid AND total_usd IS NOT NULL
+        ORDER BY total_usd DESC
+        LIMIT 1
+        """,
+        params={},
+        source="canned",
+        intent="most_expensive_receipt",
+    )
+
+
+# canned SQL filters on receipts.user_id itself (the sandbox adds the same
+# predicate) so the leading column of the ix_receipts_user_* indexes is used.
+#
+# (keywords, patterns, builder): patterns only run if one of the keywords is
+# a substring of the question; every pattern requires one of its keywords
+_INTENTS: tuple[tuple[tuple[str, ...], tuple[re.Pattern[str], ...], Callable[[], RoutedQuery]], ...] = (
+    (
+        ("this month", "current month"),
+        (
+            re.compile(r"\b(total|sum)\b.*\b(this month|current month)\b"),
+            re.compile(r"\bspent\b.*\bthis month\b"),
+        ),
+        _canned_total_this_month,
+    ),
+    (
+        ("last month",),
+        (
+            re.compile(r"\b(total|sum)\b.*\blast month\b"),
+            re.compile(r"\bspent\b.*\blast month\b"),
+        ),
+        _canned_total_last_month,
+    ),
+    (
+        ("merchant", "store", "shop"),
+        (re.compile(r"\b(top|most)\b.*\b(merchants?|stores?|shops?)\b"),),
+        _canned_top_merchants,
+    ),
+    (
+        ("most expensive", "largest", "biggest"),
+        (re.compile(r"\b(most expensive|largest|biggest)\b"),),
+        _canned_most_expensive,
+    ),
+)
+
+
+def _route_canned(question: str) -> RoutedQuery | None:
+    q = question.strip().lower()
+
+    for keywords, patterns, build in _INTENTS:
+        if not any(k in q for k in keywords):
+            continue
+        if any(p.search(q) for p in patterns):
+            return build()
 
     return None
 
@@ -203,11 +279,12 @@ Table receipts:
 - merchant TEXT
 - purchase_datetime DATETIME
 - total FLOAT
-- total_usd FLOAT
+- total_usd FLOAT  -- total * fx_rate
 - currency TEXT
+- fx_rate FLOAT  -- currency -> USD rate
 - image_path TEXT
 - raw_ocr_text TEXT
-- raw_llm_json TEXT
+- raw_llm_json JSON
 - error TEXT
 - version INTEGER
 - category TEXT  -- one of GROCERIES, CAFE, RESTAURANT, TRANSPORT, PHARMACY, UTILITIES, ENTERTAINMENT, CLOTHING, ELECTRONICS, OTHER
@@ -222,6 +299,10 @@ Table receipt_items:
 - line_total_usd FLOAT
 """
 
+# SQL for this schema fits in ~120 tokens; answers are 1-3 sentences
+_SQL_MAX_OUTPUT_TOKENS = 200
+_SUMMARY_MAX_OUTPUT_TOKENS = 180
+
 _SQL_SYSTEM = (
     "You generate read-only SQLite SELECT queries for receipt analytics.\n"
     "Rules:\n"
@@ -249,18 +330,19 @@ def _extract_sql(text: str) -> str:
     return t.strip().strip(";").strip()
 
 
-def _llm_generate_sql(question: str) -> str:
-    client = OpenAI(api_key=settings.OPENAI_API_KEY or None)
-
-    resp = client.responses.create(
-        model=getattr(settings, "OPENAI_SQL_MODEL", settings.OPENAI_OCR_MODEL),
-        input=[
-            {"role": "system", "content": _SQL_SYSTEM + "\n" + _SCHEMA_HINT},
-            {"role": "user", "content": f"Question: {question}\nSQL:"},
-        ],
-        temperature=0,
-        max_output_tokens=600,
-    )
+async def _llm_generate_sql(question: str) -> str:
+    async with openai_limiter.slot():
+        raw = await get_interactive_client().responses.with_raw_response.create(
+            model=settings.OPENAI_SQL_MODEL,
+            input=[
+                {"role": "system", "content": _SQL_SYSTEM + "\n" + _SCHEMA_HINT},
+                {"role": "user", "content": f"Question: {question}\nSQL:"},
+            ],
+            temperature=0,
+            max_output_tokens=_SQL_MAX_OUTPUT_TOKENS,
+        )
+    openai_limiter.observe_headers(raw.headers)
+    resp = raw.parse()
     sql = _extract_sql(resp.output_text)
     if not sql:
         raise HTTPException(status_code=500, detail="LLM returned empty SQL")
@@ -269,8 +351,8 @@ def _llm_generate_sql(question: str) -> str:
 
 # --------- query engine (sandbox -> execute) ----------
 
-def _execute_sql(db: Session, sql: str, params: dict[str, Any]) -> tuple[list[str], list[list[Any]]]:
-    result = db.execute(sql_text(sql), params)
+async def _execute_sql(db: AsyncSession, sql: str, params: dict[str, Any]) -> tuple[list[str], list[list[Any]]]:
+    result = await db.execute(sql_text(sql), params)
     rows = result.fetchall()
     cols = list(result.keys())
     # convert to plain lists (json friendly)
@@ -290,165 +372,238 @@ _SUMMARY_SYSTEM = (
     "  * For 'how much / сколько потратил' questions: answer 0 in the requested currency.\n"
     "  * For yes/no questions like 'были ли': answer 'Нет'.\n"
     "  * Otherwise: say there is no data for this question.\n"
-    "- Be concise (1-3 sentences). Do not mention SQL/databases.\n"
+    "- Be terse: 1-3 sentences. Do not mention SQL/databases.\n"
 )
 
 
-def _llm_summarize(question: str, columns: list[str], rows: list[list[Any]], target_currency: str) -> str:
-    client = OpenAI(api_key=settings.OPENAI_API_KEY or None)
+_EMPTY_ANSWER = "I couldn't generate an answer from the data."
 
-    # limit context size
-    preview_rows = rows[:30]
+# settings are read once at startup, so the derived rates never change
+_FX_BASE = {
+    "usd_to_rub": settings.usd_to_rub,
+    "usd_to_eur": settings.usd_to_eur,
+    "usd_to_chf": settings.usd_to_chf,
+}
 
-    rub_to_usd = float(getattr(settings, "FX_RUB_TO_USD", 0.0) or 0.0)
-    eur_to_usd = float(getattr(settings, "FX_EUR_TO_USD", 0.0) or 0.0)
-    chf_to_usd = float(getattr(settings, "FX_CHF_TO_USD", 0.0) or 0.0)
+# never worth prompt tokens; raw_* can be kilobytes per row
+_SUMMARY_DROP_COLUMNS = frozenset({"raw_ocr_text", "raw_llm_json", "image_path", "error"})
+_SUMMARY_MAX_COLUMNS = 8
 
-    fx = {
-        "target_currency": target_currency,
-        "usd_to_rub": (1.0 / rub_to_usd) if rub_to_usd else None,                      # 1 USD = X RUB
-        "usd_to_eur": (1.0 / eur_to_usd) if eur_to_usd else None,  # derived
-        "usd_to_chf": (1.0 / chf_to_usd) if chf_to_usd else None,  # derived
-    }
 
+def _table_csv(columns: list[str], rows: list[list[Any]]) -> str:
+    keep = [i for i, c in enumerate(columns) if c.lower() not in _SUMMARY_DROP_COLUMNS][:_SUMMARY_MAX_COLUMNS]
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow([columns[i] for i in keep])
+    writer.writerows([["" if r[i] is None else r[i] for i in keep] for r in rows])
+    return buf.getvalue()
+
+
+async def _llm_summarize(
+    question: str, columns: list[str], rows: list[list[Any]], target_currency: str
+) -> AsyncIterator[str]:
+    """Yields answer text deltas as they arrive from the model."""
+
+    # limit context size
+    preview_rows = rows[:30]
+
+    fx = {**_FX_BASE, "target_currency": target_currency}
 
-    payload = {"columns": columns, "rows": preview_rows, "row_count": len(rows), "fx": fx}
+    user_msg = (
+        f"Question: {question}\n"
+        f"row_count={len(rows)}\n"
+        f"Table CSV:\n{_table_csv(columns, preview_rows)}"
+        f"FX: {json.dumps(fx, separators=(',', ':'))}\n"
+        "Answer:"
+    )
 
-    resp = client.responses.create(
-        model=getattr(settings, "OPENAI_SUMMARY_MODEL", settings.OPENAI_OCR_MODEL),
+    async with openai_limiter.slot(), get_interactive_client().responses.stream(
+        model=settings.OPENAI_SUMMARY_MODEL,
         input=[
             {"role": "system", "content": _SUMMARY_SYSTEM},
-            {"role": "user", "content": f"Question: {question}\nTable JSON: {payload}\nAnswer:"},
+            {"role": "user", "content": user_msg},
         ],
         temperature=0.2,
-        max_output_tokens=250,
+        max_output_tokens=_SUMMARY_MAX_OUTPUT_TOKENS,
+    ) as stream:
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+
+
+def _sse(data: Any, event: str | None = None) -> str:
+    body = orjson.dumps(data, default=str).decode()
+    if event:
+        return f"event: {event}\ndata: {body}\n\n"
+    return f"data: {body}\n\n"
+
+
+async def _logged_events(
+    events: AsyncGenerator[str, None], log_row: dict[str, Any], t0: float
+) -> AsyncIterator[str]:
+    # logs from the generator's finally: a response background task never runs if the client
+    # disconnects mid-stream, which is common for SSE
+    finished = False
+    try:
+        async for chunk in events:
+            yield chunk
+        finished = True
+    finally:
+        await events.aclose()
+        if not finished and log_row["error"] is None:
+            log_row["error"] = "client disconnected"
+        if not log_row["latency_ms"]:
+            log_row["latency_ms"] = int((time.perf_counter() - t0) * 1000)
+        await log_chat_query(log_row)
+
+
+def _sse_response(events: AsyncGenerator[str, None], log_row: dict[str, Any], t0: float) -> StreamingResponse:
+    return StreamingResponse(
+        _logged_events(events, log_row, t0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    ans = (resp.output_text or "").strip()
-    return ans or "I couldn't generate an answer from the data."
 
 
-@router.post("", response_model=ChatResponse)
-def chat(
+@router.post("", response_class=StreamingResponse)
+async def chat(
     payload: ChatRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
+    """
+    Streams the answer as Server-Sent Events:
+    - `meta`: {"source": ..., "sql": ...}
+    - `table`: {"columns": [...], "rows": [[...], ...]}
+    - unnamed events: JSON-encoded chunks of the answer text
+    - `done`: {"answer": ...} with the full answer
+    - `error`: {"detail": ...} if the summarizer fails mid-stream
+    """
     question = payload.question.strip()
 
-    # ---- rate limit ----
     t0 = time.perf_counter()
-    chosen_source = "unknown"
-    generated_sql: str | None = None
-    sandbox_sql: str | None = None
-    error: str | None = None
+    log_row: dict[str, Any] = {
+        "user_id": user.id,
+        "question": question,
+        "chosen_source": "unknown",
+        "generated_sql": None,
+        "sandbox_sql": None,
+        "error": None,
+        "latency_ms": 0,
+    }
+    response: StreamingResponse | None = None
 
     try:
-        _rate_limit(user.id)
+        # ---- rate limit ----
+        await _rate_limit(user.id)
 
         # 1) intent router: canned first
         routed = _route_canned(question)
         if routed is None:
             # 2) fallback: LLM -> SQL
-            generated_sql = _llm_generate_sql(question)
-            routed = RoutedQuery(sql=generated_sql, params={}, source="llm")
+            log_row["generated_sql"] = await _llm_generate_sql(question)
+            routed = RoutedQuery(sql=log_row["generated_sql"], params={}, source="llm")
         else:
-            generated_sql = routed.sql
+            log_row["generated_sql"] = routed.sql
 
-        chosen_source = routed.source
+        log_row["chosen_source"] = routed.source
 
         # 3) sandbox (enforce SELECT-only, forbid dangerous, enforce user filter, enforce limit)
         try:
             sand = sanitize_sql(routed.sql, user_id=user.id)
         except SQLSandboxError as e:
-            error = f"sandbox: {e}"
+            log_row["error"] = f"sandbox: {e}"
             raise HTTPException(status_code=400, detail=f"SQL rejected by sandbox: {e}")
 
-        sandbox_sql = sand.sql
+        log_row["sandbox_sql"] = sand.sql
         exec_params = {**sand.params, **routed.params}  # uid + template params
+        meta = {"source": routed.source, "sql": sand.sql}
 
-        # ---- canned cache (TTL, in-memory) ----
+        # ---- canned cache (TTL, shared via Redis) ----
         cache_key = None
         if routed.source == "canned" and getattr(routed, "intent", None):
-            params_key = tuple(sorted((k, str(v)) for k, v in routed.params.items()))
-            cache_key = (user.id, routed.intent, params_key)
+            cache_key = _canned_cache_key(user.id, routed.intent, routed.params)
 
-            cached = _cache_get(cache_key)
+            cached = await cache_get(cache_key)
             if cached:
-                # cache hit: still log via finally
-                return ChatResponse(
-                    answer=cached["answer"],
-                    sql=cached["sql"],
-                    source="canned",
-                    table=cached["table"],
-                )
+                async def replay_cached() -> AsyncIterator[str]:
+                    yield _sse(meta, "meta")
+                    yield _sse(cached["table"], "table")
+                    yield _sse(cached["answer"])
+                    yield _sse({"answer": cached["answer"]}, "done")
+                    log_row["latency_ms"] = int((time.perf_counter() - t0) * 1000)
+
+                response = _sse_response(replay_cached(), log_row, t0)
+                return response
 
         # 4) execute
         try:
-            columns, rows = _execute_sql(db, sand.sql, exec_params)
+            columns, rows = await _execute_sql(db, sand.sql, exec_params)
         except Exception as e:
-            error = f"sql_exec: {e}"
+            log_row["error"] = f"sql_exec: {e}"
             raise HTTPException(status_code=400, detail=f"SQL execution error: {e}")
 
-        # 5) summarizer
-        try:
-            target_currency = _detect_target_currency(question)
-            answer = _llm_summarize(question, columns, rows, target_currency)
-        except Exception as e:
-            error = f"summarizer: {e}"
-            raise HTTPException(status_code=502, detail="Failed to generate summary")
-
         table = {"columns": columns, "rows": rows[:50]}
-        resp = ChatResponse(
-            answer=answer,
-            sql=sand.sql,
-            source=routed.source,
-            table=table,
-        )
+        target_currency = _detect_target_currency(question)
+
+        summary_key = _summary_cache_key(question, columns, rows)
+
+        # 5) summarizer, streamed token by token after the table
+        async def event_stream() -> AsyncIterator[str]:
+            yield _sse(meta, "meta")
+            yield _sse(table, "table")
+
+            answer = await cache_get(summary_key)
+            if answer:
+                yield _sse(answer)
+            else:
+                parts: list[str] = []
+                try:
+                    async for delta in _llm_summarize(question, columns, rows, target_currency):
+                        parts.append(delta)
+                        yield _sse(delta)
+                except Exception as e:
+                    log_row["error"] = f"summarizer: {e}"
+                    log_row["latency_ms"] = int((time.perf_counter() - t0) * 1000)
+                    yield _sse({"detail": "Failed to generate summary"}, "error")
+                    return
+
+                answer = "".join(parts).strip()
+                if answer:
+                    await cache_set(summary_key, answer, _SUMMARY_CACHE_TTL_SECONDS)
+                else:
+                    answer = _EMPTY_ANSWER
+                    yield _sse(answer)
+
+            log_row["latency_ms"] = int((time.perf_counter() - t0) * 1000)
+
+            # save to cache if canned
+            if cache_key is not None:
+                await cache_set(
+                    cache_key,
+                    {"answer": answer, "sql": sand.sql, "table": table},
+                    _CANNED_CACHE_TTL_SECONDS,
+                )
 
-        # save to cache if canned
-        if cache_key is not None:
-            _cache_set(cache_key, {"answer": resp.answer, "sql": resp.sql, "table": resp.table})
+            yield _sse({"answer": answer}, "done")
 
-        return resp
+        response = _sse_response(event_stream(), log_row, t0)
+        return response
 
     except HTTPException as e:
         # ensure we log the error detail
-        if error is None:
-            error = str(e.detail)
+        if log_row["error"] is None:
+            log_row["error"] = str(e.detail)
         raise
 
     except Exception as e:
         # unexpected error -> 500, but log the original exception
-        if error is None:
-            error = f"unhandled: {e}"
+        if log_row["error"] is None:
+            log_row["error"] = f"unhandled: {e}"
         raise HTTPException(status_code=500, detail="Internal error")
 
     finally:
-        latency_ms = int((time.perf_counter() - t0) * 1000)
-
-        # best-effort logging; do not break endpoint if logging fails
-        try:
-            # important: session may be in failed state after an exception
-            try:
-                db.rollback()
-            except Exception:
-                pass
-
-            db.add(
-                ChatQuery(
-                    user_id=user.id,
-                    question=question,
-                    chosen_source=chosen_source,
-                    generated_sql=generated_sql,
-                    sandbox_sql=sandbox_sql,
-                    error=error,
-                    latency_ms=latency_ms,
-                )
-            )
-            db.commit()
-        except Exception:
-            try:
-                db.rollback()
-            except Exception:
-                pass
-
+        # failed before streaming started: log right away
+        if response is None:
+            log_row["latency_ms"] = int((time.perf_counter() - t0) * 1000)
+            await log_chat_query(log_row)
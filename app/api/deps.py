@@ -1,28 +1,32 @@
-from typing import Generator
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator
 
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.core.db import SessionLocal
+from app.core.db import AsyncSessionLocal
 from app.models.user import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# verified token -> (user_id, exp); skips HMAC + username lookup until the token expires
+_TOKEN_CACHE: OrderedDict[str, tuple[int, int]] = OrderedDict()
+_TOKEN_CACHE_MAX = 10_000
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> User:
     cred_exc = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -30,6 +34,17 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    cached = _TOKEN_CACHE.get(token)
+    if cached is not None and cached[1] > time.time():
+        _TOKEN_CACHE.move_to_end(token)
+        user = await db.get(User, cached[0])
+        if not user:
+            _TOKEN_CACHE.pop(token, None)
+            raise cred_exc
+        return user
+    # expired entries fall through; jwt.decode rejects them
+    _TOKEN_CACHE.pop(token, None)
+
     try:
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.jwt_alg])
         sub = payload.get("sub")
@@ -38,7 +53,13 @@ def get_current_user(
     except JWTError:
         raise cred_exc
 
-    user = db.query(User).filter(User.username == sub).first()
+    user = await db.scalar(select(User).where(User.username == sub))
     if not user:
         raise cred_exc
+
+    exp = payload.get("exp")
+    if isinstance(exp, int):
+        _TOKEN_CACHE[token] = (user.id, exp)
+        if len(_TOKEN_CACHE) > _TOKEN_CACHE_MAX:
+            _TOKEN_CACHE.popitem(last=False)
     return user
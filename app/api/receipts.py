@@ -2,104 +2,218 @@ from __future__ import annotations
 
 from datetime import datetime, timezone
 from pathlib import Path
-from shutil import copyfileobj
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile, status
-from sqlalchemy.orm import Session
+import aiofiles
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, Query, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_current_user, get_db
 from app.models.receipt import Receipt
 from app.models.receipt_item import ReceiptItem
 from app.models.receipt_task import ReceiptTask
 from app.models.user import User
-from app.schemas.receipt import ReceiptOut
+from app.schemas.receipt import ReceiptListOut, ReceiptOut, ReceiptTaskStatusOut
 
-import base64
-import mimetypes
-from openai import OpenAI
 from app.core.config import settings
+from app.core.task_wakeup import notify_new_task
+from app.core.openai_client import get_interactive_client, openai_limiter
+from app.services.ocr_provider import VISION_MIME_TYPES, downscaled_jpeg
 
 
 router = APIRouter(prefix="/receipts", tags=["receipts"])
 
 UPLOAD_DIR = Path("app/uploads")
 ALLOWED_CURRENCIES = {"USD", "EUR", "CHF"}
+_UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+def _sniff_image_suffix(head: bytes) -> str | None:
+    """Returns the file suffix for PNG/JPEG/WEBP/BMP/TIFF magic bytes, None for anything else."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head.startswith(b"BM"):
+        return ".bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return ".tiff"
+    return None
+
+
+async def _get_receipt_with_items(db: AsyncSession, receipt_id: int, user_id: int) -> Receipt | None:
+    # items are lazy="raise": only the endpoints that render them load them
+    return await db.scalar(
+        select(Receipt)
+        .options(selectinload(Receipt.items))
+        .where(Receipt.id == receipt_id, Receipt.user_id == user_id)
+        .execution_options(populate_existing=True)
+    )
 
 
-@router.post("/upload", response_model=ReceiptOut, status_code=status.HTTP_201_CREATED)
-def upload_receipt(
-    file: UploadFile = File(...),
-    currency: str = Form("USD"),
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
-):
-    # validate currency
-    currency = (currency or "AUTO").upper()
-    if currency not in {"AUTO", "USD", "EUR", "CHF", "RUB"}:
-        raise HTTPException(status_code=400, detail="currency must be one of AUTO, USD, EUR, CHF, RUB")
+_SUFFIX_MIME = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".tiff": "image/tiff",
+}
 
 
-    # validate file
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Only image uploads are supported")
+async def _read_image_head(file: UploadFile) -> tuple[bytes, str]:
+    # content_type is client-supplied: trust the bytes, not the header
+    if file.size is not None and file.size > settings.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File is too large")
+    head = await file.read(16)
+    suffix = _sniff_image_suffix(head)
+    if suffix is None:
+        raise HTTPException(status_code=400, detail="Only PNG, JPEG, WEBP, BMP and TIFF images are supported")
+    return head, suffix
 
-    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-    # save file
-    orig_suffix = Path(file.filename).suffix.lower() if file.filename else ""
-    suffix = orig_suffix if orig_suffix in {".png", ".jpg", ".jpeg", ".webp"} else ".jpg"
-    safe_name = f"{uuid4().hex}{suffix}"
-    save_path = UPLOAD_DIR / safe_name
+def _normalize_currency(currency: str | None) -> str:
+    currency = (currency or "AUTO").upper()
+    if currency not in {"AUTO", "USD", "EUR", "CHF", "RUB"}:
+        raise HTTPException(status_code=400, detail="currency must be one of AUTO, USD, EUR, CHF, RUB")
+    return currency
+
 
+async def _save_upload(file: UploadFile) -> Path:
+    """Validates the image and streams it into UPLOAD_DIR; always closes the upload."""
     try:
-        with save_path.open("wb") as out:
-            copyfileobj(file.file, out)
+        if not file.content_type or not file.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="Only image uploads are supported")
+        head, suffix = await _read_image_head(file)
+
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        save_path = UPLOAD_DIR / f"{uuid4().hex}{suffix}"
+        try:
+            written = len(head)
+            async with aiofiles.open(save_path, "wb") as out:
+                await out.write(head)
+                while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > settings.MAX_UPLOAD_BYTES:
+                        raise HTTPException(status_code=413, detail="File is too large")
+                    await out.write(chunk)
+        except HTTPException:
+            save_path.unlink(missing_ok=True)
+            raise
+        return save_path
     finally:
         try:
-            file.file.close()
+            await file.close()
         except Exception:
             pass
 
-    # create receipt + enqueue task
-    try:
-        receipt = Receipt(
+
+async def _create_receipts(db: AsyncSession, user: User, currency: str, paths: list[Path]) -> list[int]:
+    """Creates the receipts and their processing tasks in one commit; returns receipt ids."""
+    receipts = [
+        Receipt(
             user_id=user.id,
             status="queued",
             version=1,
             currency=currency,
-            image_path=str(save_path).replace("\\", "/"),
+            image_path=str(path).replace("\\", "/"),
         )
-        db.add(receipt)
-        db.flush()  # get receipt.id
-
-        task = ReceiptTask(
+        for path in paths
+    ]
+    db.add_all(receipts)
+    await db.flush()  # get receipt ids
+
+    run_after = datetime.now(timezone.utc)
+    db.add_all([
+        ReceiptTask(
             receipt_id=receipt.id,
             status="queued",
             receipt_version=receipt.version,
-            run_after=datetime.now(timezone.utc),
+            run_after=run_after,
         )
-        db.add(task)
+        for receipt in receipts
+    ])
+    await db.commit()
+    return [receipt.id for receipt in receipts]
+
+
+@router.post("/upload", response_model=ReceiptOut, status_code=status.HTTP_201_CREATED)
+async def upload_receipt(
+    file: UploadFile = File(...),
+    currency: str = Form("USD"),
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    currency = _normalize_currency(currency)
+    save_path = await _save_upload(file)
 
-        db.commit()
-        db.refresh(receipt)
-        return receipt
+    # create receipt + enqueue task
+    try:
+        receipt_id = (await _create_receipts(db, user, currency, [save_path]))[0]
+        await notify_new_task()
+        return await _get_receipt_with_items(db, receipt_id, user.id)
 
     except Exception as e:
-        db.rollback()
-        try:
-            if save_path.exists():
-                save_path.unlink()
-        except Exception:
-            pass
+        await db.rollback()
+        save_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Failed to enqueue receipt processing: {e}")
+
+
+@router.post("/upload-bulk", response_model=list[ReceiptListOut], status_code=status.HTTP_201_CREATED)
+async def upload_receipts_bulk(
+    files: list[UploadFile] = File(...),
+    currency: str = Form("USD"),
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Several receipts in one request: all files are accepted or none are."""
+    currency = _normalize_currency(currency)
+    if len(files) > settings.MAX_BULK_UPLOAD_FILES:
+        for file in files:
+            await file.close()
+        raise HTTPException(status_code=400, detail=f"At most {settings.MAX_BULK_UPLOAD_FILES} files per request")
+
+    saved: list[Path] = []
+    try:
+        for file in files:
+            try:
+                saved.append(await _save_upload(file))
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code, detail=f"{file.filename}: {e.detail}")
+    except HTTPException:
+        for file in files:
+            await file.close()
+        for path in saved:
+            path.unlink(missing_ok=True)
+        raise
+
+    try:
+        receipt_ids = await _create_receipts(db, user, currency, saved)
+        await notify_new_task()
+    except Exception as e:
+        await db.rollback()
+        for path in saved:
+            path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"Failed to enqueue receipt processing: {e}")
 
+    receipts = await db.scalars(
+        select(Receipt)
+        .where(Receipt.id.in_(receipt_ids))
+        .order_by(Receipt.id)
+        .execution_options(populate_existing=True)
+    )
+    return receipts.all()
+
 
 @router.post("/{receipt_id}/reprocess", response_model=ReceiptOut)
-def reprocess_receipt(
+async def reprocess_receipt(
     receipt_id: int,
     currency: str | None = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
     """
@@ -108,10 +222,8 @@ def reprocess_receipt(
     - enqueues a new ReceiptTask with the new version
     Currency is NOT changed here (it was chosen at upload).
     """
-    receipt = (
-        db.query(Receipt)
-        .filter(Receipt.id == receipt_id, Receipt.user_id == user.id)
-        .first()
+    receipt = await db.scalar(
+        select(Receipt).where(Receipt.id == receipt_id, Receipt.user_id == user.id)
     )
     if not receipt:
         raise HTTPException(status_code=404, detail="Receipt not found")
@@ -133,10 +245,7 @@ def reprocess_receipt(
         receipt.merchant = None
         receipt.purchase_datetime = None
         receipt.total = None
-
-        # if you added usd fields in model, reset them too
-        if hasattr(receipt, "total_usd"):
-            receipt.total_usd = None  # type: ignore[attr-defined]
+        receipt.fx_rate = None
 
         receipt.raw_ocr_text = None
         receipt.raw_llm_json = None
@@ -144,7 +253,7 @@ def reprocess_receipt(
         db.add(receipt)
 
         # delete old items
-        db.query(ReceiptItem).filter(ReceiptItem.receipt_id == receipt.id).delete()
+        await db.execute(delete(ReceiptItem).where(ReceiptItem.receipt_id == receipt.id))
 
         # enqueue new task for the new version
         task = ReceiptTask(
@@ -155,111 +264,123 @@ def reprocess_receipt(
         )
         db.add(task)
 
-        db.commit()
-        db.refresh(receipt)
-        return receipt
+        await db.commit()
+        await notify_new_task()
+        return await _get_receipt_with_items(db, receipt.id, user.id)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to reprocess receipt: {e}")
 
 
 @router.get("/{receipt_id}", response_model=ReceiptOut)
-def get_receipt(
+async def get_receipt(
     receipt_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    receipt = (
-        db.query(Receipt)
-        .filter(Receipt.id == receipt_id, Receipt.user_id == user.id)
-        .first()
-    )
+    receipt = await _get_receipt_with_items(db, receipt_id, user.id)
     if not receipt:
         raise HTTPException(status_code=404, detail="Receipt not found")
     return receipt
 
 
-@router.get("", response_model=list[ReceiptOut])
-def list_receipts(
-    db: Session = Depends(get_db),
+_LIST_COLUMNS = tuple(getattr(Receipt, name) for name in ReceiptListOut.model_fields)
+
+
+@router.get("", response_model=list[ReceiptListOut])
+async def list_receipts(
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    ids: str | None = Query(None, description="Comma-separated receipt ids, e.g. 1,2,3"),
 ):
-    receipts = (
-        db.query(Receipt)
-        .filter(Receipt.user_id == user.id)
+    # only the list columns: raw_ocr_text / raw_llm_json can be tens of KB per row
+    stmt = select(*_LIST_COLUMNS).where(Receipt.user_id == user.id)
+
+    # status of many receipts in one request instead of polling them one by one
+    if ids:
+        try:
+            id_list = [int(x) for x in ids.split(",") if x.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+        if len(id_list) > 200:
+            raise HTTPException(status_code=400, detail="At most 200 ids per request")
+        stmt = stmt.where(Receipt.id.in_(id_list))
+
+    result = await db.execute(
+        stmt
         .order_by(Receipt.uploaded_at.desc())
         .offset(offset)
         .limit(limit)
-        .all()
     )
-    return receipts
+    return result.mappings().all()
 
 
-@router.get("/{receipt_id}/task")
-def get_receipt_task(
+@router.get("/{receipt_id}/task", response_model=ReceiptTaskStatusOut)
+async def get_receipt_task(
     receipt_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    receipt = (
-        db.query(Receipt)
-        .filter(Receipt.id == receipt_id, Receipt.user_id == user.id)
-        .first()
-    )
-    if not receipt:
+    # ownership check + newest task in one round trip
+    row = (await db.execute(
+        select(Receipt, ReceiptTask)
+        .outerjoin(ReceiptTask, ReceiptTask.receipt_id == Receipt.id)
+        .where(Receipt.id == receipt_id, Receipt.user_id == user.id)
+        .order_by(ReceiptTask.created_at.desc(), ReceiptTask.id.desc())
+        .limit(1)
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Receipt not found")
 
-    task = (
-        db.query(ReceiptTask)
-        .filter(ReceiptTask.receipt_id == receipt_id)
-        .order_by(ReceiptTask.created_at.desc())
-        .first()
-    )
-    if not task:
-        return {"receipt_id": receipt_id, "task": None}
-
+    receipt, task = row
     return {
         "receipt_id": receipt_id,
-        "task": {
-            "id": task.id,
-            "status": task.status,
-            "attempts": task.attempts,
-            "receipt_version": task.receipt_version,
-            "run_after": task.run_after,
-            "locked_at": task.locked_at,
-            "locked_by": task.locked_by,
-            "last_error": task.last_error,
-            "created_at": task.created_at,
-            "updated_at": task.updated_at,
-        },
+        "task": task,
         "receipt_version": receipt.version,
         "receipt_status": receipt.status,
         "receipt_currency": receipt.currency,
     }
 
+async def _delete_openai_file(file_id: str) -> None:
+    try:
+        await get_interactive_client().files.delete(file_id)
+    except Exception:
+        pass
+
+
 @router.post("/detect-currency")
-def detect_currency(
+async def detect_currency(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user: User = Depends(get_current_user),
 ):
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Only image uploads are supported")
-
     allowed = {"USD", "EUR", "CHF", "RUB"}
+    client = get_interactive_client()
 
-    # read bytes
-    data = file.file.read()
+    # upload the image once and reference it by id instead of inlining base64 in the prompt
     try:
-        file.file.close()
-    except Exception:
-        pass
-
-    mime = file.content_type or "image/jpeg"
-    b64 = base64.b64encode(data).decode("utf-8")
-    data_url = f"data:{mime};base64,{b64}"
+        if not file.content_type or not file.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="Only image uploads are supported")
+        _, suffix = await _read_image_head(file)
+        await file.seek(0)
+
+        name, content, mime = file.filename or "receipt", file.file, _SUFFIX_MIME[suffix]
+        if mime not in VISION_MIME_TYPES:
+            content = await run_in_threadpool(downscaled_jpeg, file.file)
+            if content is None:
+                raise HTTPException(status_code=400, detail="Could not read the image")
+            name, mime = f"{Path(name).stem}.jpg", "image/jpeg"
+
+        async with openai_limiter.slot():
+            uploaded = await client.files.create(file=(name, content, mime), purpose="vision")
+    finally:
+        try:
+            await file.close()
+        except Exception:
+            pass
 
     prompt = (
         "You are a classifier.\n"
@@ -268,19 +389,28 @@ def detect_currency(
         "If ambiguous or not visible -> UNKNOWN.\n"
     )
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY or None)
-    resp = client.responses.create(
-        model=settings.OPENAI_OCR_MODEL,  # gpt-4o-mini
-        input=[{
-            "role": "user",
-            "content": [
-                {"type": "input_text", "text": prompt},
-                {"type": "input_image", "image_url": data_url},
-            ],
-        }],
-        temperature=0,
-        max_output_tokens=10,
-    )
+    try:
+        async with openai_limiter.slot():
+            raw = await client.responses.with_raw_response.create(
+                model=settings.OPENAI_OCR_MODEL,  # gpt-4o-mini
+                input=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "input_text", "text": prompt},
+                        {"type": "input_image", "file_id": uploaded.id},
+                    ],
+                }],
+                temperature=0,
+                max_output_tokens=10,
+            )
+        openai_limiter.observe_headers(raw.headers)
+        resp = raw.parse()
+    except Exception:
+        await _delete_openai_file(uploaded.id)
+        raise
+
+    # the uploaded file is only needed for this one call
+    background_tasks.add_task(_delete_openai_file, uploaded.id)
 
     cur = (resp.output_text or "").strip().upper()
     cur = cur.split()[0] if cur else "UNKNOWN"
@@ -0,0 +1,29 @@
+from typing import Mapping
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# multipart boundaries + form fields on top of the file itself
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+class BodySizeLimitMiddleware:
+    """Rejects requests whose Content-Length exceeds the upload limit before the body is read."""
+
+    def __init__(self, app: ASGIApp, max_bytes: int, path_limits: Mapping[str, int] | None = None) -> None:
+        self.app = app
+        self.max_bytes = max_bytes + _MULTIPART_OVERHEAD
+        # exact path -> limit, for endpoints that take several files
+        self.path_limits = {path: limit + _MULTIPART_OVERHEAD for path, limit in (path_limits or {}).items()}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+                    if value.isdigit() and int(value) > max_bytes:
+                        response = JSONResponse({"detail": "Request body is too large"}, status_code=413)
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
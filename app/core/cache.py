@@ -0,0 +1,52 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+redis_client: Redis | None = (
+    Redis.from_url(settings.REDIS_URL, decode_responses=True) if settings.REDIS_URL else None
+)
+
+# fallback when REDIS_URL is not set: key -> (expires_at, value), least recently used first
+_LOCAL_CACHE: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+_LOCAL_CACHE_MAX = 1_000
+
+
+async def cache_get(key: str) -> Any | None:
+    """Returns the JSON-decoded value or None on miss (Redis errors count as a miss)."""
+    if redis_client is None:
+        item = _LOCAL_CACHE.get(key)
+        if not item:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            _LOCAL_CACHE.pop(key, None)
+            return None
+        _LOCAL_CACHE.move_to_end(key)
+        return value
+
+    try:
+        raw = await redis_client.get(key)
+    except RedisError:
+        return None
+    return json.loads(raw) if raw is not None else None
+
+
+async def cache_set(key: str, value: Any, ttl_seconds: int) -> None:
+    if redis_client is None:
+        # bounded LRU: expired entries are dropped on read or pushed out by newer ones
+        _LOCAL_CACHE[key] = (time.time() + ttl_seconds, value)
+        _LOCAL_CACHE.move_to_end(key)
+        if len(_LOCAL_CACHE) > _LOCAL_CACHE_MAX:
+            _LOCAL_CACHE.popitem(last=False)
+        return
+
+    try:
+        await redis_client.set(key, json.dumps(value, ensure_ascii=False, default=str), ex=ttl_seconds)
+    except RedisError:
+        pass
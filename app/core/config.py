@@ -1,3 +1,5 @@
+from functools import cached_property
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,6 +7,15 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_ignore_empty=True)
 
     DATABASE_URL: str = "sqlite:///./app/data/app.db"
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE_SECONDS: int = 3600
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    # empty -> per-process in-memory cache / rate limit
+    REDIS_URL: str = ""
+    # receipt images; larger request bodies are rejected before they are read
+    MAX_UPLOAD_BYTES: int = 10 * 1024 * 1024
+    MAX_BULK_UPLOAD_FILES: int = 20
 
     JWT_SECRET: str = "change-me"
     jwt_alg: str = "HS256"
@@ -13,10 +24,28 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = ""
     OPENAI_OCR_MODEL: str = "gpt-4o-mini"
     OPENAI_STRUCT_MODEL: str = "gpt-4o-mini"
+    # chat: SQL generation and answer summary; point SQL at a smaller model to cut latency
+    OPENAI_SQL_MODEL: str = "gpt-4o-mini"
+    OPENAI_SUMMARY_MODEL: str = "gpt-4o-mini"
+    OPENAI_TIMEOUT_SECONDS: float = 60.0
+    # upper bound for in-flight API calls per process (adapted down on 429/5xx)
+    OPENAI_MAX_CONCURRENCY: int = 32
     FX_EUR_TO_USD: float = 1.0
     FX_CHF_TO_USD: float = 1.0
     FX_RUB_TO_USD: float = 1.0
 
+    # inverse rates for the chat summarizer: 1 USD = X <currency>
+    @cached_property
+    def usd_to_rub(self) -> float | None:
+        return (1.0 / self.FX_RUB_TO_USD) if self.FX_RUB_TO_USD else None
+
+    @cached_property
+    def usd_to_eur(self) -> float | None:
+        return (1.0 / self.FX_EUR_TO_USD) if self.FX_EUR_TO_USD else None
+
+    @cached_property
+    def usd_to_chf(self) -> float | None:
+        return (1.0 / self.FX_CHF_TO_USD) if self.FX_CHF_TO_USD else None
 
 
 settings = Settings()
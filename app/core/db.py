@@ -1,5 +1,7 @@
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import orjson
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
 
 from app.core.config import settings
 
@@ -8,24 +10,58 @@ class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args=(
-        {"check_same_thread": False, "timeout": 30}
-        if settings.DATABASE_URL.startswith("sqlite")
-        else {}
-    ),
+_IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
+
+def _async_url(url: str) -> str:
+    """Maps a sync DATABASE_URL onto the matching async driver."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql:"):
+        return "postgresql+asyncpg:" + url[len("postgresql:"):]
+    if url.startswith("postgresql+psycopg2:"):
+        return "postgresql+asyncpg:" + url[len("postgresql+psycopg2:"):]
+    return url
+
+
+_POOL_KWARGS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
     pool_pre_ping=True,
 )
 
-if settings.DATABASE_URL.startswith("sqlite"):
-    @event.listens_for(engine, "connect")
-    def _set_sqlite_pragmas(dbapi_connection, _):
-        cur = dbapi_connection.cursor()
-        cur.execute("PRAGMA journal_mode=WAL;")
-        cur.execute("PRAGMA synchronous=NORMAL;")
-        cur.execute("PRAGMA foreign_keys=ON;")
-        cur.close()
+
+def _json_dumps(value) -> str:
+    # compact and without \uXXXX escapes for non-ASCII text
+    return orjson.dumps(value).decode()
+
+
+def _set_sqlite_pragmas(dbapi_connection, _):
+    cur = dbapi_connection.cursor()
+    cur.execute("PRAGMA journal_mode=WAL;")
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    cur.execute("PRAGMA foreign_keys=ON;")
+    cur.close()
+
+
+# API and worker both run on asyncio; alembic builds its own sync engine
+engine = create_async_engine(
+    _async_url(settings.DATABASE_URL),
+    connect_args={"timeout": 30} if _IS_SQLITE else {},
+    json_serializer=_json_dumps,
+    json_deserializer=orjson.loads,
+    **_POOL_KWARGS,
+)
+
+if _IS_SQLITE:
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
 
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
@@ -0,0 +1,133 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Mapping
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from app.core.config import settings
+
+# keep TCP/TLS (and HTTP/2) connections to the API alive between calls
+_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+_TIMEOUT = httpx.Timeout(settings.OPENAI_TIMEOUT_SECONDS, connect=10.0)
+
+
+@lru_cache(maxsize=1)
+def get_async_client() -> AsyncOpenAI:
+    # created lazily so the app still starts without OPENAI_API_KEY.
+    # max_retries=0: worker calls retry via openai_retry only, the SDK's own retries would multiply with it
+    return AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY or None,
+        http_client=httpx.AsyncClient(http2=True, limits=_LIMITS, timeout=_TIMEOUT),
+        max_retries=0,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_interactive_client() -> AsyncOpenAI:
+    # API request paths are not wrapped in openai_retry (a 30s backoff is too long for a user
+    # waiting on /chat): the SDK's short retries are their only retry layer. Shares the connection pool
+    return get_async_client().with_options(max_retries=2)
+
+
+# "1s", "250ms", "6m0s" -> seconds
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+class AdmissionController:
+    """
+    AIMD concurrency limit for OpenAI calls:
+    - every success raises the limit by `increase` (up to `max_limit`)
+    - a 429 / 5xx multiplies it by `decrease` (down to 1)
+    - retry-after and a nearly exhausted x-ratelimit-remaining-requests pause new calls
+    """
+
+    def __init__(self, max_limit: int, increase: float = 0.5, decrease: float = 0.5) -> None:
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._pause_until = 0.0
+        self._cond = asyncio.Condition()
+
+    def _pause(self, seconds: float | None) -> None:
+        if seconds:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        try:
+            remaining = int(headers["x-ratelimit-remaining-requests"])
+            limit = int(headers["x-ratelimit-limit-requests"])
+        except (KeyError, ValueError):
+            return
+        if remaining < 0.1 * limit:
+            self._pause(_parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0)
+
+    def _on_success(self) -> None:
+        self.limit = min(float(self.max_limit), self.limit + self.increase)
+
+    def _on_overload(self, exc: APIStatusError) -> None:
+        self.limit = max(1.0, self.limit * self.decrease)
+        self._pause(_parse_duration(exc.response.headers.get("retry-after")))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        while (delay := self._pause_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+        try:
+            yield
+        except RateLimitError as e:
+            self._on_overload(e)
+            raise
+        except APIStatusError as e:
+            if e.status_code >= 500:
+                self._on_overload(e)
+            raise
+        else:
+            self._on_success()
+        finally:
+            async with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+
+openai_limiter = AdmissionController(settings.OPENAI_MAX_CONCURRENCY)
+
+
+# transient failures only (APITimeoutError is an APIConnectionError); a bad request is not worth paying for twice.
+# jitter keeps workers from retrying in lockstep after an outage
+openai_retry = retry(
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+    wait=wait_random_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
@@ -6,14 +6,27 @@ from passlib.context import CryptContext
 
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# OWASP argon2id profile: 19 MiB, 2 iterations, 1 lane
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
+
+# verified against when the user does not exist, so unknown usernames cost the same
+_DUMMY_HASH = pwd_context.hash("dummy-password")
 
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def verify_password(password: str, password_hash: str) -> bool:
+def verify_password(password: str, password_hash: str | None) -> bool:
+    if password_hash is None:
+        pwd_context.verify(password, _DUMMY_HASH)
+        return False
     return pwd_context.verify(password, password_hash)
 
 
@@ -0,0 +1,37 @@
+import asyncio
+
+from redis.exceptions import RedisError
+
+from app.core.cache import redis_client
+
+# the API pushes a token after enqueueing a ReceiptTask; an idle worker BLPOPs it
+_WAKE_KEY = "receipt_tasks:wake"
+
+# without Redis the worker can only poll
+enabled = redis_client is not None
+
+
+async def notify_new_task() -> None:
+    if redis_client is None:
+        return
+    try:
+        # one pending token is enough to wake a worker
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lpush(_WAKE_KEY, "1")
+            pipe.ltrim(_WAKE_KEY, 0, 0)
+            await pipe.execute()
+    except RedisError:
+        pass
+
+
+async def wait_for_new_task(timeout: float) -> bool:
+    """Returns True when woken by the API, False after `timeout` seconds."""
+    if redis_client is None:
+        await asyncio.sleep(timeout)
+        return False
+    try:
+        # BLPOP treats 0 as "block forever"
+        return await redis_client.blpop([_WAKE_KEY], timeout=max(timeout, 0.1)) is not None
+    except RedisError:
+        await asyncio.sleep(timeout)
+        return False
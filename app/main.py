@@ -1,12 +1,36 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import FileResponse
 from starlette.staticfiles import StaticFiles
 
 from app.api.auth import router as auth_router
 from app.api.receipts import router as receipts_router
 from app.api.chat import router as chat_router
+from app.core.body_limit import BodySizeLimitMiddleware
+from app.core.config import settings
+from app.services.chat_log import start_chat_log_writer, stop_chat_log_writer
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await start_chat_log_writer()
+    try:
+        yield
+    finally:
+        await stop_chat_log_writer()
+
+
+app = FastAPI(title="Receipt Analysis System", lifespan=lifespan)
 
-app = FastAPI(title="Receipt Analysis System")
+# receipt lists and chat tables compress well; SSE responses are skipped by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=settings.MAX_UPLOAD_BYTES,
+    path_limits={"/receipts/upload-bulk": settings.MAX_UPLOAD_BYTES * settings.MAX_BULK_UPLOAD_FILES},
+)
 
 app.include_router(auth_router)
 app.include_router(receipts_router)
@@ -1,5 +1,8 @@
 from datetime import datetime
-from sqlalchemy import String, DateTime, Float, ForeignKey, Text, func, Integer, text
+from typing import Any
+
+from sqlalchemy import JSON, Computed, String, DateTime, Float, ForeignKey, Index, Text, func, Integer, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.core.db import Base
@@ -7,6 +10,12 @@ from app.core.db import Base
 
 class Receipt(Base):
     __tablename__ = "receipts"
+    __table_args__ = (
+        # chat analytics: per-user filters on status/date, merchant grouping, top totals
+        Index("ix_receipts_user_status_pdt", "user_id", "status", "purchase_datetime"),
+        Index("ix_receipts_user_merchant", "user_id", "merchant"),
+        Index("ix_receipts_user_total_usd", "user_id", "total_usd"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
 
@@ -21,10 +30,16 @@ class Receipt(Base):
     currency: Mapped[str | None] = mapped_column(String(8), nullable=True)
 
     image_path: Mapped[str | None] = mapped_column(String(1024), nullable=True)
-    total_usd: Mapped[float | None] = mapped_column(Float, nullable=True)
+    # currency -> USD rate applied when the receipt was processed; total_usd follows it in the DB
+    fx_rate: Mapped[float | None] = mapped_column(Float, nullable=True)
+    total_usd: Mapped[float | None] = mapped_column(Float, Computed("total * fx_rate", persisted=True))
 
     raw_ocr_text: Mapped[str | None] = mapped_column(Text, nullable=True)
-    raw_llm_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # compact JSON; binary JSONB on Postgres
+    raw_llm_json: Mapped[dict[str, Any] | None] = mapped_column(
+        JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql"),
+        nullable=True,
+    )
 
     version: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("1"))
 
@@ -39,5 +54,5 @@ class Receipt(Base):
         "ReceiptItem",
         back_populates="receipt",
         cascade="all, delete-orphan",
-        lazy="selectin",
+        lazy="raise",
     )
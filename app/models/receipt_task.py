@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text, func, text
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, Text, func, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.core.db import Base
@@ -7,12 +7,24 @@ from app.core.db import Base
 
 class ReceiptTask(Base):
     __tablename__ = "receipt_tasks"
+    __table_args__ = (
+        # CLAIM_SQL: walk queued tasks in created_at order, stop at LIMIT
+        Index(
+            "ix_tasks_claim", "status", "run_after", "created_at",
+            postgresql_where=text("status IN ('queued', 'processing')"),
+        ),
+        # REQUEUE_STALE_SQL
+        Index(
+            "ix_tasks_stale", "status", "locked_at",
+            postgresql_where=text("status IN ('queued', 'processing')"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
 
     receipt_id: Mapped[int] = mapped_column(ForeignKey("receipts.id"), index=True, nullable=False)
 
-    status: Mapped[str] = mapped_column(String(32), default="queued", nullable=False, index=True)
+    status: Mapped[str] = mapped_column(String(32), default="queued", nullable=False)
 
     attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
 
@@ -1,4 +1,6 @@
 from datetime import datetime
+from typing import Any
+
 from pydantic import BaseModel
 
 
@@ -13,7 +15,7 @@ class ReceiptItemOut(BaseModel):
     model_config = {"from_attributes": True}
 
 
-class ReceiptOut(BaseModel):
+class ReceiptListOut(BaseModel):
     id: int
     status: str
     uploaded_at: datetime
@@ -25,14 +27,40 @@ class ReceiptOut(BaseModel):
     purchase_datetime: datetime | None = None
 
     image_path: str | None = None
-    raw_ocr_text: str | None = None
-    raw_llm_json: str | None = None
 
     detected_currency: str | None = None
     category: str | None = None
 
     error: str | None = None
 
+    model_config = {"from_attributes": True}
+
+
+class ReceiptOut(ReceiptListOut):
+    raw_ocr_text: str | None = None
+    raw_llm_json: dict[str, Any] | None = None
+
     items: list[ReceiptItemOut] = []
 
+
+class ReceiptTaskOut(BaseModel):
+    id: int
+    status: str
+    attempts: int
+    receipt_version: int
+    run_after: datetime
+    locked_at: datetime | None = None
+    locked_by: str | None = None
+    last_error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
     model_config = {"from_attributes": True}
+
+
+class ReceiptTaskStatusOut(BaseModel):
+    receipt_id: int
+    task: ReceiptTaskOut | None = None
+    receipt_version: int
+    receipt_status: str
+    receipt_currency: str | None = None
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+from sqlalchemy import insert
+
+from app.core.db import AsyncSessionLocal
+from app.models.chat_query import ChatQuery
+
+_BATCH_SIZE = 100
+_QUEUE_MAX = 10_000
+
+_queue: asyncio.Queue[dict[str, Any] | None] | None = None
+_writer: asyncio.Task | None = None
+
+
+async def log_chat_query(row: dict[str, Any]) -> None:
+    """Queues a chat_queries row; never waits on the DB and drops the row if the queue is full."""
+    if _queue is None:
+        return
+    try:
+        _queue.put_nowait(row)
+    except asyncio.QueueFull:
+        pass
+
+
+async def _write_batch(batch: list[dict[str, Any]]) -> None:
+    # best-effort logging; a failed batch is dropped
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(ChatQuery), batch)
+            await db.commit()
+    except Exception:
+        pass
+
+
+async def _run_writer(queue: asyncio.Queue[dict[str, Any] | None]) -> None:
+    # one commit per batch instead of one per request; None means shut down
+    while True:
+        row = await queue.get()
+        batch: list[dict[str, Any]] = []
+        while row is not None:
+            batch.append(row)
+            if len(batch) >= _BATCH_SIZE or queue.empty():
+                break
+            row = queue.get_nowait()
+        if batch:
+            await _write_batch(batch)
+        if row is None:
+            return
+
+
+async def start_chat_log_writer() -> None:
+    global _queue, _writer
+    _queue = asyncio.Queue(maxsize=_QUEUE_MAX)
+    _writer = asyncio.create_task(_run_writer(_queue))
+
+
+async def stop_chat_log_writer() -> None:
+    """Flushes whatever is still queued and stops the writer."""
+    global _queue, _writer
+    queue, writer = _queue, _writer
+    _queue, _writer = None, None
+    if writer is None or queue is None:
+        return
+
+    await queue.put(None)
+    await writer
@@ -1,32 +1,100 @@
 from __future__ import annotations
 
+import asyncio
 import base64
+import hashlib
+import io
 import mimetypes
-import time
 import os
+from collections.abc import Collection
 from pathlib import Path
+from typing import BinaryIO
 
-from openai import OpenAI
+from openai import AsyncOpenAI
+from PIL import Image, ImageOps
+from pydantic import BaseModel, Field
 
+from app.core.cache import cache_get, cache_set
 from app.core.config import settings
+from app.core.openai_client import get_async_client, openai_retry
+
+# multiple of 3 so chunk encodings concatenate without padding in between
+_B64_CHUNK = 57 * 1024
+
+# the vision model downsizes anything bigger than 2048px anyway; small files are sent as is
+_MAX_IMAGE_SIDE = 2048
+_DOWNSCALE_MIN_BYTES = 500 * 1024
+_JPEG_QUALITY = 85
+
+# formats the vision model takes as is; anything else (BMP, TIFF) is converted to JPEG
+VISION_MIME_TYPES = frozenset({"image/png", "image/jpeg", "image/webp", "image/gif"})
+
+# re-uploads and reprocessing of the same image skip the vision call
+_OCR_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+
+def _file_digest(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=20)).hexdigest()
+
+
+def downscaled_jpeg(src: Path | BinaryIO) -> bytes | None:
+    """JPEG re-encode capped at 2048px per side; None if Pillow cannot read the image."""
+    try:
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE), Image.LANCZOS)
+            buf = io.BytesIO()
+            im.convert("RGB").save(buf, "JPEG", quality=_JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return buf.getvalue()
+
+
+def _image_data_url(path: Path, mime: str) -> str:
+    if mime not in VISION_MIME_TYPES or path.stat().st_size >= _DOWNSCALE_MIN_BYTES:
+        raw = downscaled_jpeg(path)
+        if raw is not None:
+            return "data:image/jpeg;base64," + base64.b64encode(raw).decode("ascii")
+
+    # encode while reading: the raw image is never held in memory next to its base64 copy
+    parts = [f"data:{mime};base64,"]
+    with path.open("rb") as f:
+        while chunk := f.read(_B64_CHUNK):
+            parts.append(base64.b64encode(chunk).decode("ascii"))
+    return "".join(parts)
+
+
+class BatchOcrOut(BaseModel):
+    ocr: list[str] = Field(description="Extracted text, one string per image, in the order the images were given.")
 
 
 class OpenAIVisionOcrProvider:
-    def __init__(self, client: OpenAI | None = None, model: str | None = None):
-        api_key = settings.OPENAI_API_KEY or None
-        self.client = client or OpenAI(api_key=api_key)
+    def __init__(self, client: AsyncOpenAI | None = None, model: str | None = None):
+        # shared client: keeps the HTTP/2 connection pool alive across receipts
+        self.client = client or get_async_client()
         self.model = model or settings.OPENAI_OCR_MODEL
 
-    def extract_text(self, image_path: str) -> str:
+    async def _cache_key(self, p: Path) -> str:
+        digest = await asyncio.to_thread(_file_digest, p)
+        return f"ocr:text:{self.model}:{digest}"
+
+    async def extract_text(self, image_path: str, refresh: bool = False) -> str:
+        """refresh skips the cached text (reprocess) and overwrites it with the new result."""
         p = Path(image_path)
         if not p.exists():
             raise FileNotFoundError(f"Image not found: {p}")
 
+        cache_key = await self._cache_key(p)
+        cached = None if refresh else await cache_get(cache_key)
+        if cached is not None:
+            return cached
+
         mime, _ = mimetypes.guess_type(str(p))
         mime = mime or "image/jpeg"
 
-        b64 = base64.b64encode(p.read_bytes()).decode("utf-8")
-        data_url = f"data:{mime};base64,{b64}"
+        # file read + base64 of a multi-MB image would stall the event loop
+        data_url = await asyncio.to_thread(_image_data_url, p, mime)
 
         prompt = (
             "You are an OCR engine for receipts.\n"
@@ -37,24 +105,86 @@ class OpenAIVisionOcrProvider:
             "- If a token is unclear, keep the best guess rather than omitting.\n"
         )
 
-        last_err: Exception | None = None
-        for attempt in range(3):
-            try:
-                resp = self.client.responses.create(
-                    model=self.model,
-                    input=[{
-                        "role": "user",
-                        "content": [
-                            {"type": "input_text", "text": prompt},
-                            {"type": "input_image", "image_url": data_url},
-                        ],
-                    }],
-                    temperature=0,
-                    max_output_tokens=2000,
-                )
-                return (resp.output_text or "").strip()
-            except Exception as e:
-                last_err = e
-                time.sleep(2 ** attempt)
-
-        raise last_err
+        text = await self._extract(prompt, data_url)
+        if text:
+            await cache_set(cache_key, text, _OCR_CACHE_TTL_SECONDS)
+        return text
+
+    @openai_retry
+    async def _extract(self, prompt: str, data_url: str) -> str:
+        resp = await self.client.responses.create(
+            model=self.model,
+            input=[{
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": prompt},
+                    {"type": "input_image", "image_url": data_url},
+                ],
+            }],
+            temperature=0,
+            max_output_tokens=2000,
+        )
+        return (resp.output_text or "").strip()
+
+    async def extract_text_batch(self, image_paths: list[str], refresh: Collection[str] = ()) -> list[str]:
+        """
+        OCR for several receipts in one request; returns texts in the order of image_paths.
+        Paths in refresh skip the cache like extract_text(refresh=True).
+        """
+        paths = [Path(path) for path in image_paths]
+        for p in paths:
+            if not p.exists():
+                raise FileNotFoundError(f"Image not found: {p}")
+
+        keys = await asyncio.gather(*(self._cache_key(p) for p in paths))
+        texts: list[str | None] = [None] * len(paths)
+        cached = [i for i, path in enumerate(image_paths) if path not in refresh]
+        for i, text in zip(cached, await asyncio.gather(*(cache_get(keys[i]) for i in cached))):
+            texts[i] = text
+        misses = [i for i, t in enumerate(texts) if t is None]
+        if misses:
+            fresh = await self._extract_batch([paths[i] for i in misses])
+            for i, text in zip(misses, fresh):
+                texts[i] = text
+                if text:
+                    await cache_set(keys[i], text, _OCR_CACHE_TTL_SECONDS)
+        return texts
+
+    async def _extract_batch(self, paths: list[Path]) -> list[str]:
+        encodes = []
+        for p in paths:
+            mime, _ = mimetypes.guess_type(str(p))
+            encodes.append(asyncio.to_thread(_image_data_url, p, mime or "image/jpeg"))
+        return await self._parse_batch(await asyncio.gather(*encodes))
+
+    @openai_retry
+    async def _parse_batch(self, data_urls: list[str]) -> list[str]:
+        # retried as a whole: falling back to per-file calls on a 429 would only add load
+        n = len(data_urls)
+        content: list[dict] = [{
+            "type": "input_text",
+            "text": (
+                "You are an OCR engine for receipts.\n"
+                f"You are given {n} receipt images, each one is a separate receipt.\n"
+                "Task: extract ALL visible text from every image.\n"
+                "Rules:\n"
+                "- Return one OCR string per image, in the same order as the images.\n"
+                "- Never merge text from different images.\n"
+                "- Preserve reading order and line breaks as much as possible.\n"
+                "- If a token is unclear, keep the best guess rather than omitting.\n"
+            ),
+        }]
+        for data_url in data_urls:
+            content.append({"type": "input_image", "image_url": data_url})
+
+        resp = await self.client.responses.parse(
+            model=self.model,
+            input=[{"role": "user", "content": content}],
+            text_format=BatchOcrOut,
+            temperature=0,
+            max_output_tokens=2000 * n,
+        )
+        texts = resp.output_parsed.ocr if resp.output_parsed else []
+        if len(texts) != n:
+            raise ValueError(f"batch OCR returned {len(texts)} texts for {n} images")
+        return [t.strip() for t in texts]
@@ -1,4 +1,5 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.receipt import Receipt
 from app.models.receipt_item import ReceiptItem
@@ -7,28 +8,30 @@ from app.services.receipt_structurer import OpenAIReceiptStructurer
 from app.core.config import settings
 
 
+# currency -> USD rate; unknown currencies are treated as USD
+_FX_TO_USD = {
+    "USD": 1.0,
+    "EUR": float(settings.FX_EUR_TO_USD),
+    "CHF": float(settings.FX_CHF_TO_USD),
+    "RUB": float(settings.FX_RUB_TO_USD),
+}
+
+
 def _fx_to_usd(curr: str) -> float:
-    c = (curr or "USD").upper()
-    if c == "USD":
-        return 1.0
-    if c == "EUR":
-        return float(settings.FX_EUR_TO_USD)
-    if c == "CHF":
-        return float(settings.FX_CHF_TO_USD)
-    if c == "RUB":
-        return float(settings.FX_RUB_TO_USD)
-    return 1.0
+    return _FX_TO_USD.get((curr or "USD").upper(), 1.0)
 
 
 def _norm_currency(c: str | None) -> str | None:
     if not c:
         return None
     c = c.strip().upper()
-    return c if c in {"USD", "EUR", "CHF", "RUB"} else None
+    return c if c in _FX_TO_USD else None
 
 
-def process_receipt(receipt_id: int, db: Session, expected_version: int) -> None:
-    receipt = db.query(Receipt).filter(Receipt.id == receipt_id).first()
+async def process_receipt(
+    receipt_id: int, db: AsyncSession, expected_version: int, ocr_text: str | None = None
+) -> None:
+    receipt = await db.scalar(select(Receipt).where(Receipt.id == receipt_id))
     if not receipt:
         return
 
@@ -38,22 +41,27 @@ def process_receipt(receipt_id: int, db: Session, expected_version: int) -> None
     receipt.status = "processing"
     receipt.error = None
     db.add(receipt)
-    db.commit()
+    await db.commit()
+
+    # version > 1 means /reprocess: the cached OCR/LLM results are exactly what is being redone
+    refresh = expected_version > 1
 
     try:
-        ocr = OpenAIVisionOcrProvider()
-        ocr_text = ocr.extract_text(receipt.image_path or "")
-        receipt.raw_ocr_text = ocr_text
-        db.add(receipt)
-        db.commit()
+        # ocr_text is passed in when the worker already OCR'd this receipt in a batch
+        if ocr_text is None:
+            ocr = OpenAIVisionOcrProvider()
+            ocr_text = await ocr.extract_text(receipt.image_path or "", refresh=refresh)
 
         structurer = OpenAIReceiptStructurer()
-        parsed = structurer.structure(ocr_text)
+        parsed = await structurer.structure(ocr_text, refresh=refresh)
 
-        db.refresh(receipt)
-        if receipt.version != expected_version:
+        # only the version matters here; a full refresh would reload raw_ocr_text / raw_llm_json
+        current_version = await db.scalar(select(Receipt.version).where(Receipt.id == receipt.id))
+        if current_version != expected_version:
             return
-        
+
+        # everything below is written in one final commit
+        receipt.raw_ocr_text = ocr_text
         det = _norm_currency(parsed.currency)
         receipt.detected_currency = det
 
@@ -61,38 +69,39 @@ def process_receipt(receipt_id: int, db: Session, expected_version: int) -> None
             receipt.currency = det or "USD"
 
         fx = _fx_to_usd(receipt.currency)
-        receipt.total_usd = (parsed.total * fx) if parsed.total is not None else None
+        receipt.fx_rate = fx  # total_usd is computed from it by the DB
         receipt.category = getattr(parsed, "category", "OTHER") or "OTHER"
         receipt.merchant = parsed.merchant
         receipt.purchase_datetime = parsed.purchase_datetime
         receipt.total = parsed.total
-        receipt.raw_llm_json = parsed.model_dump_json(indent=2, ensure_ascii=False)
+        receipt.raw_llm_json = parsed.model_dump(mode="json")
 
-        db.query(ReceiptItem).filter(ReceiptItem.receipt_id == receipt.id).delete()
+        await db.execute(delete(ReceiptItem).where(ReceiptItem.receipt_id == receipt.id))
+        item_rows = []
         for it in parsed.items:
             line_total = it.line_total
             if line_total is None and it.quantity is not None and it.unit_price is not None:
                 line_total = it.quantity * it.unit_price
 
-            db.add(
-                ReceiptItem(
-                    receipt_id=receipt.id,
-                    name=it.name,
-                    quantity=it.quantity,
-                    unit_price=it.unit_price,
-                    line_total=line_total,
-                    line_total_usd=(line_total * fx) if line_total is not None else None,
-                )
-            )
-
+            item_rows.append({
+                "receipt_id": receipt.id,
+                "name": it.name,
+                "quantity": it.quantity,
+                "unit_price": it.unit_price,
+                "line_total": line_total,
+                "line_total_usd": (line_total * fx) if line_total is not None else None,
+            })
+        # one executemany instead of a unit-of-work INSERT per item
+        if item_rows:
+            await db.execute(insert(ReceiptItem), item_rows)
 
         receipt.status = "done"
         db.add(receipt)
-        db.commit()
+        await db.commit()
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         receipt.status = "error"
         receipt.error = str(e)
         db.add(receipt)
-        db.commit()
+        await db.commit()
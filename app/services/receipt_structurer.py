@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import hashlib
 from datetime import datetime
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field, conlist
 
+from app.core.cache import cache_get, cache_set
 from app.core.config import settings
+from app.core.openai_client import get_async_client, openai_retry
 from typing import Literal, Optional
 from pydantic import field_validator
 
@@ -24,6 +27,38 @@ Category = Literal[
 ]
 
 
+# model output -> Category; exact names first, then Russian word stems
+_CATEGORY_EXACT: dict[str, str] = {
+    **{c: c for c in (
+        "GROCERIES", "CAFE", "RESTAURANT", "TRANSPORT", "PHARMACY",
+        "UTILITIES", "ENTERTAINMENT", "CLOTHING", "ELECTRONICS", "OTHER",
+    )},
+    "CAFÉ": "CAFE", "COFFEE": "CAFE", "COFFEESHOP": "CAFE", "BAR": "CAFE",
+    "DINER": "RESTAURANT",
+    "GROCERY": "GROCERIES", "SUPERMARKET": "GROCERIES",
+    "TAXI": "TRANSPORT", "UBER": "TRANSPORT", "BUS": "TRANSPORT", "METRO": "TRANSPORT",
+    "DRUGSTORE": "PHARMACY",
+    "BILLS": "UTILITIES",
+    "CINEMA": "ENTERTAINMENT", "MOVIE": "ENTERTAINMENT",
+    "APPAREL": "CLOTHING",
+}
+
+_CATEGORY_SUBSTRINGS: tuple[tuple[str, str], ...] = (
+    ("КАФ", "CAFE"), ("КОФ", "CAFE"),
+    ("РЕСТ", "RESTAURANT"),
+    ("СУПЕР", "GROCERIES"), ("МАГАЗ", "GROCERIES"),
+    ("ТАКС", "TRANSPORT"), ("МЕТРО", "TRANSPORT"),
+    ("АПТ", "PHARMACY"),
+    ("КОММУН", "UTILITIES"),
+    ("КИНО", "ENTERTAINMENT"),
+    ("ОДЕЖ", "CLOTHING"),
+    ("ЭЛЕКТР", "ELECTRONICS"),
+)
+
+
+_STRUCT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+
 class ParsedItem(BaseModel):
     name: str = Field(description="Product/service name as it appears on the receipt.")
     quantity: Optional[float] = Field(default=None, description="Quantity if present.")
@@ -62,40 +97,24 @@ class ParsedReceipt(BaseModel):
             return "OTHER"
         s = str(v).strip().upper()
 
-        if s in {"CAFE", "CAFÉ", "COFFEE", "COFFEESHOP", "BAR"} or "КАФ" in s or "КОФ" in s:
-            return "CAFE"
-        if s in {"RESTAURANT", "DINER"} or "РЕСТ" in s:
-            return "RESTAURANT"
-        if s in {"GROCERY", "GROCERIES", "SUPERMARKET"} or "СУПЕР" in s or "МАГАЗ" in s:
-            return "GROCERIES"
-        if s in {"TRANSPORT", "TAXI", "UBER", "BUS", "METRO"} or "ТАКС" in s or "МЕТРО" in s:
-            return "TRANSPORT"
-        if s in {"PHARMACY", "DRUGSTORE"} or "АПТ" in s:
-            return "PHARMACY"
-        if s in {"UTILITIES", "BILLS"} or "КОММУН" in s:
-            return "UTILITIES"
-        if s in {"ENTERTAINMENT", "CINEMA", "MOVIE"} or "КИНО" in s:
-            return "ENTERTAINMENT"
-        if s in {"CLOTHING", "APPAREL"} or "ОДЕЖ" in s:
-            return "CLOTHING"
-        if s in {"ELECTRONICS"} or "ЭЛЕКТР" in s:
-            return "ELECTRONICS"
-
-        allowed = {
-            "GROCERIES","CAFE","RESTAURANT","TRANSPORT","PHARMACY",
-            "UTILITIES","ENTERTAINMENT","CLOTHING","ELECTRONICS","OTHER"
-        }
-        return s if s in allowed else "OTHER"
+        return _CATEGORY_EXACT.get(s) or next((c for sub, c in _CATEGORY_SUBSTRINGS if sub in s), "OTHER")
 
 
 
 class OpenAIReceiptStructurer:
-    def __init__(self, client: OpenAI | None = None, model: str | None = None):
-        api_key = settings.OPENAI_API_KEY or None
-        self.client = client or OpenAI(api_key=api_key)
+    def __init__(self, client: AsyncOpenAI | None = None, model: str | None = None):
+        # shared client: keeps the HTTP/2 connection pool alive across receipts
+        self.client = client or get_async_client()
         self.model = model or getattr(settings, "OPENAI_STRUCT_MODEL", settings.OPENAI_OCR_MODEL)
 
-    def structure(self, ocr_text: str) -> ParsedReceipt:
+    async def structure(self, ocr_text: str, refresh: bool = False) -> ParsedReceipt:
+        """refresh skips the cached result (reprocess) and overwrites it with the new one."""
+        digest = hashlib.blake2b(ocr_text.encode("utf-8"), digest_size=20).hexdigest()
+        cache_key = f"ocr:struct:{self.model}:{digest}"
+        cached = None if refresh else await cache_get(cache_key)
+        if cached is not None:
+            return ParsedReceipt.model_validate(cached)
+
         system = (
             "You are a receipt information extraction engine.\n"
             "Extract structured fields from OCR text of a receipt.\n"
@@ -128,19 +147,27 @@ class OpenAIReceiptStructurer:
                     )
                     max_out = 1200
 
-                resp = self.client.responses.parse(
-                    model=self.model,
-                    input=[
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    text_format=ParsedReceipt,
-                    temperature=0,
-                    max_output_tokens=max_out,
-                )
-                return resp.output_parsed
+                parsed = await self._parse(system, user, max_out)
+                # the header-only fallback is not cached: a later run may get the full result
+                if attempt == 0 and parsed is not None:
+                    await cache_set(cache_key, parsed.model_dump(mode="json"), _STRUCT_CACHE_TTL_SECONDS)
+                return parsed
 
             except Exception as e:
                 last_err = e
 
         raise last_err  # type: ignore
+
+    @openai_retry
+    async def _parse(self, system: str, user: str, max_out: int) -> ParsedReceipt | None:
+        resp = await self.client.responses.parse(
+            model=self.model,
+            input=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            text_format=ParsedReceipt,
+            temperature=0,
+            max_output_tokens=max_out,
+        )
+        return resp.output_parsed
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import re
 from dataclasses import dataclass
+from functools import lru_cache
 
 import sqlglot
 from sqlglot import exp
@@ -13,7 +15,7 @@ class SQLSandboxError(ValueError):
 _UID_TOKEN = "__bind_uid__"
 _MAX_LIMIT = 200
 
-_DANGEROUS_SUBSTRINGS = {
+_DANGEROUS_SUBSTRINGS = frozenset({
     "sqlite_master",
     "sqlite_temp_master",
     "sqlite_schema",
@@ -23,7 +25,30 @@ _DANGEROUS_SUBSTRINGS = {
     "vacuum",
     "load_extension",
     "reindex",
-}
+})
+
+# one pass over the SQL instead of a substring scan per keyword
+_DANGEROUS_RE = re.compile("|".join(map(re.escape, sorted(_DANGEROUS_SUBSTRINGS))), re.IGNORECASE)
+
+
+_FORBIDDEN_NODES = tuple(
+    klass
+    for klass in (
+        getattr(exp, name, None)
+        for name in (
+            "Insert",
+            "Update",
+            "Delete",
+            "Create",
+            "Drop",
+            "Alter",
+            "Truncate",
+            "Command",
+            "Transaction",
+        )
+    )
+    if klass is not None
+)
 
 
 @dataclass(frozen=True)
@@ -44,10 +69,15 @@ def sanitize_sql(sql: str, user_id: int) -> SandboxResult:
         raise SQLSandboxError("Empty SQL")
 
     raw = sql.strip().strip(";").strip()
-    raw_l = raw.lower()
+    return SandboxResult(sql=_sanitize_template(raw), params={"uid": int(user_id)})
+
+
+@lru_cache(maxsize=1024)
+def _sanitize_template(raw: str) -> str:
+    # user-independent: the uid stays a bind param, so repeated SQL skips parsing
 
     # quick reject: obvious dangerous substrings
-    if any(s in raw_l for s in _DANGEROUS_SUBSTRINGS):
+    if _DANGEROUS_RE.search(raw):
         raise SQLSandboxError("Dangerous SQL keyword/table detected")
 
     # reject multiple statements early
@@ -69,15 +99,15 @@ def sanitize_sql(sql: str, user_id: int) -> SandboxResult:
     if outer is None:
         raise SQLSandboxError("Only SELECT statements are allowed")
 
-    # walk the whole AST: forbid non-select DML/DDL
-    _reject_forbidden_nodes(stmt)
+    # one walk over the AST: forbid non-select DML/DDL, collect tables
+    tables = _collect_tables(stmt)
 
     # allow only our tables + CTE names (so LLM can use WITH)
     allowed_tables = {"receipts", "receipt_items"} | _cte_names(stmt)
-    _validate_tables(stmt, allowed_tables)
+    _validate_tables(tables, allowed_tables)
 
     # enforce tenant filter via receipts alias
-    receipts_alias = _find_receipts_alias(stmt)
+    receipts_alias = _find_receipts_alias(tables)
     if receipts_alias is None:
         raise SQLSandboxError("Query must reference 'receipts' table to enforce user scope")
 
@@ -94,7 +124,7 @@ def sanitize_sql(sql: str, user_id: int) -> SandboxResult:
         .replace(_UID_TOKEN, ":uid")
     )
 
-    return SandboxResult(sql=safe_sql, params={"uid": int(user_id)})
+    return safe_sql
 
 
 def _outer_select(stmt: exp.Expression) -> exp.Select | None:
@@ -117,30 +147,19 @@ def _cte_names(stmt: exp.Expression) -> set[str]:
     return names
 
 
-def _reject_forbidden_nodes(stmt: exp.Expression) -> None:
-    forbidden_names = [
-        "Insert",
-        "Update",
-        "Delete",
-        "Create",
-        "Drop",
-        "Alter",
-        "Truncate",
-        "Command",
-        "Transaction",
-    ]
-
-    for name in forbidden_names:
-        klass = getattr(exp, name, None)
-        if klass is None:
-            continue
-        if next(stmt.find_all(klass), None) is not None:
+def _collect_tables(stmt: exp.Expression) -> list[exp.Table]:
+    # breadth-first, same order as find_all
+    tables: list[exp.Table] = []
+    for node in stmt.walk():
+        if isinstance(node, _FORBIDDEN_NODES):
             raise SQLSandboxError("Only SELECT is allowed (DML/DDL detected)")
+        if isinstance(node, exp.Table):
+            tables.append(node)
+    return tables
 
 
-
-def _validate_tables(stmt: exp.Expression, allowed_tables: set[str]) -> None:
-    for t in stmt.find_all(exp.Table):
+def _validate_tables(tables: list[exp.Table], allowed_tables: set[str]) -> None:
+    for t in tables:
         name = (t.name or "").lower()
         if not name:
             continue
@@ -150,8 +169,8 @@ def _validate_tables(stmt: exp.Expression, allowed_tables: set[str]) -> None:
             raise SQLSandboxError(f"Table '{name}' is not allowed")
 
 
-def _find_receipts_alias(stmt: exp.Expression) -> str | None:
-    for t in stmt.find_all(exp.Table):
+def _find_receipts_alias(tables: list[exp.Table]) -> str | None:
+    for t in tables:
         if (t.name or "").lower() == "receipts":
             alias = t.alias_or_name
             return alias
@@ -1,18 +1,34 @@
+import asyncio
 import os
-import time
 from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import text
+from sqlalchemy import select, text, update
 
-from app.core.db import SessionLocal
+from app.core import task_wakeup
+from app.core.db import AsyncSessionLocal
+from app.models.receipt import Receipt
+from app.services.ocr_provider import OpenAIVisionOcrProvider
 from app.services.receipt_processor import process_receipt
 
 POLL_SECONDS = int(os.getenv("WORKER_POLL_SECONDS", "2"))
+# with Redis the API wakes the worker on upload; polling then only picks up retries and stale locks
+IDLE_POLL_SECONDS = int(os.getenv("WORKER_IDLE_POLL_SECONDS", "30")) if task_wakeup.enabled else POLL_SECONDS
 WORKER_ID = os.getenv("WORKER_ID", "worker-1")
 MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
 
 LOCK_TIMEOUT_SECONDS = int(os.getenv("TASK_LOCK_TIMEOUT_SECONDS", "180"))
 
+# tasks claimed per UPDATE ... RETURNING, and receipts processed at once
+BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "8"))
+MAX_CONCURRENCY = int(os.getenv("WORKER_MAX_CONCURRENCY", "8"))
+
+# receipts sharing one vision OCR request (1 disables batching), capped by raw image size
+OCR_BATCH_SIZE = int(os.getenv("WORKER_OCR_BATCH_SIZE", "4"))
+OCR_BATCH_MAX_BYTES = 16 * 1024 * 1024
+# the batch call (with openai_retry backoff) must finish well before a stale-lock requeue
+# could hand the same receipts to another worker; on timeout they are OCR'd one by one
+OCR_BATCH_TIMEOUT_SECONDS = LOCK_TIMEOUT_SECONDS / 3
+
 
 REQUEUE_STALE_SQL = text("""
 UPDATE receipt_tasks
@@ -36,20 +52,21 @@ SET
   locked_by=:worker,
   attempts=attempts+1,
   updated_at=:now
-WHERE id = (
+WHERE id IN (
   SELECT id
   FROM receipt_tasks
   WHERE status='queued' AND run_after <= :now
   ORDER BY created_at
-  LIMIT 1
+  LIMIT :batch
 )
+AND status='queued'
 RETURNING id, receipt_id, receipt_version, attempts;
 """)
 
 
-def mark_done(db, task_id: int):
+async def mark_done(db, task_id: int):
     now = datetime.now(timezone.utc)
-    db.execute(
+    await db.execute(
         text("""
         UPDATE receipt_tasks
         SET status='done', locked_at=NULL, locked_by=NULL, updated_at=:now
@@ -57,14 +74,14 @@ def mark_done(db, task_id: int):
         """),
         {"now": now, "id": task_id},
     )
-    db.commit()
+    await db.commit()
 
 
-def mark_failed(db, task_id: int, attempts: int, err: str):
+async def mark_failed(db, task_id: int, attempts: int, err: str):
     now = datetime.now(timezone.utc)
 
     if attempts >= MAX_ATTEMPTS:
-        db.execute(
+        await db.execute(
             text("""
             UPDATE receipt_tasks
             SET status='error', last_error=:err, locked_at=NULL, locked_by=NULL, updated_at=:now
@@ -72,13 +89,13 @@ def mark_failed(db, task_id: int, attempts: int, err: str):
             """),
             {"err": err, "now": now, "id": task_id},
         )
-        db.commit()
+        await db.commit()
         return
 
     delay_minutes = 2 ** (attempts - 1)
     run_after = now + timedelta(minutes=delay_minutes)
 
-    db.execute(
+    await db.execute(
         text("""
         UPDATE receipt_tasks
         SET status='queued', run_after=:run_after, last_error=:err,
@@ -87,73 +104,158 @@ def mark_failed(db, task_id: int, attempts: int, err: str):
         """),
         {"run_after": run_after, "err": err, "now": now, "id": task_id},
     )
-    db.commit()
+    await db.commit()
 
 
-def set_receipt_processing(db, receipt_id: int):
-    now = datetime.now(timezone.utc)
-    db.execute(
-        text("""
-        UPDATE receipts
-        SET status='processing'
-        WHERE id=:rid;
-        """),
-        {"rid": receipt_id},
-    )
-    db.commit()
+async def claim_tasks(limit: int) -> list:
+    async with AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
 
+        stale_before = now - timedelta(seconds=LOCK_TIMEOUT_SECONDS)
+        await db.execute(REQUEUE_STALE_SQL, {"now": now, "stale_before": stale_before})
 
-def main():
-    print(f"[worker] started worker_id={WORKER_ID} poll={POLL_SECONDS}s "
-          f"max_attempts={MAX_ATTEMPTS} lock_timeout={LOCK_TIMEOUT_SECONDS}s")
+        result = await db.execute(CLAIM_SQL, {"now": now, "worker": WORKER_ID, "batch": limit})
+        rows = result.mappings().all()
+        await db.commit()
+        return rows
 
-    while True:
-        db = SessionLocal()
+
+async def batch_ocr(rows) -> dict[int, str]:
+    """receipt_id -> OCR text for the rows OCR'd together; receipts left out get OCR'd one by one."""
+    if len(rows) < 2:
+        return {}
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Receipt.id, Receipt.image_path, Receipt.version)
+            .where(Receipt.id.in_([int(r["receipt_id"]) for r in rows]))
+        )
+        current = {rid: (path, version) for rid, path, version in result.all()}
+
+        # tasks superseded by a newer /reprocess are skipped by process_receipt: don't OCR them
+        paths: dict[int, str] = {}
+        for r in rows:
+            rid = int(r["receipt_id"])
+            path, version = current.get(rid, (None, None))
+            if path and version == int(r["receipt_version"]):
+                paths[rid] = path
+
+        # the batch call can take a while: show progress now instead of when process_receipt starts
+        if len(paths) >= 2:
+            await db.execute(
+                update(Receipt).where(Receipt.id.in_(list(paths))).values(status="processing", error=None)
+            )
+            await db.commit()
+
+    # reprocessed receipts (version > 1) bypass the OCR cache, see process_receipt
+    reprocess = {int(r["receipt_id"]) for r in rows if int(r["receipt_version"]) > 1}
+
+    receipt_ids: list[int] = []
+    image_paths: list[str] = []
+    total_bytes = 0
+    for rid, path in paths.items():
         try:
-            now = datetime.now(timezone.utc)
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if total_bytes + size > OCR_BATCH_MAX_BYTES:
+            continue
+        total_bytes += size
+        receipt_ids.append(rid)
+        image_paths.append(path)
 
-            stale_before = now - timedelta(seconds=LOCK_TIMEOUT_SECONDS)
-            db.execute(REQUEUE_STALE_SQL, {"now": now, "stale_before": stale_before})
-            db.commit()
+    if len(image_paths) < 2:
+        return {}
 
-            result = db.execute(CLAIM_SQL, {"now": now, "worker": WORKER_ID})
-            row = result.mappings().first()
-            result.close()
-            db.commit()
+    try:
+        texts = await asyncio.wait_for(
+            OpenAIVisionOcrProvider().extract_text_batch(
+                image_paths, refresh={path for rid, path in zip(receipt_ids, image_paths) if rid in reprocess}
+            ),
+            OCR_BATCH_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        print(f"[worker] batch OCR of {len(image_paths)} receipts failed, falling back: {e!r}")
+        return {}
+    return dict(zip(receipt_ids, texts))
 
-            if not row:
-                time.sleep(POLL_SECONDS)
-                continue
 
-            try:
-                task_id = int(row["id"])
-                receipt_id = int(row["receipt_id"])
-                receipt_version = int(row["receipt_version"])
-                attempts = int(row["attempts"])
-            except Exception as e:
-                try:
-                    task_id = int(row.get("id", 0)) if row else 0
-                except Exception:
-                    task_id = 0
-                if task_id:
-                    mark_failed(db, task_id, MAX_ATTEMPTS, f"worker parse error: {e}")
-                continue
+async def run_group(rows) -> None:
+    ocr_texts = await batch_ocr(rows)
+    await asyncio.gather(*(run_task(row, ocr_texts.get(row["receipt_id"])) for row in rows))
+
 
+async def run_task(row, ocr_text: str | None = None) -> None:
+    async with AsyncSessionLocal() as db:
+        try:
+            task_id = int(row["id"])
+            receipt_id = int(row["receipt_id"])
+            receipt_version = int(row["receipt_version"])
+            attempts = int(row["attempts"])
+        except Exception as e:
             try:
-                set_receipt_processing(db, receipt_id)
+                task_id = int(row.get("id", 0)) if row else 0
+            except Exception:
+                task_id = 0
+            if task_id:
+                await mark_failed(db, task_id, MAX_ATTEMPTS, f"worker parse error: {e}")
+            return
 
-                process_receipt(receipt_id, db, expected_version=receipt_version)
+        try:
+            # process_receipt marks the receipt as processing itself
+            await process_receipt(receipt_id, db, expected_version=receipt_version, ocr_text=ocr_text)
 
-                mark_done(db, task_id)
-                print(f"[worker] task={task_id} receipt={receipt_id} done")
+            await mark_done(db, task_id)
+            print(f"[worker] task={task_id} receipt={receipt_id} done")
 
+        except Exception as e:
+            await db.rollback()
+            await mark_failed(db, task_id, attempts, str(e))
+            print(f"[worker] task={task_id} receipt={receipt_id} failed: {e}")
+
+
+async def run() -> None:
+    print(f"[worker] started worker_id={WORKER_ID} poll={IDLE_POLL_SECONDS}s wakeup={task_wakeup.enabled} "
+          f"max_attempts={MAX_ATTEMPTS} lock_timeout={LOCK_TIMEOUT_SECONDS}s "
+          f"batch={BATCH_SIZE} concurrency={MAX_CONCURRENCY} ocr_batch={OCR_BATCH_SIZE}")
+
+    # receipts spend most of their time waiting on OpenAI: keep up to
+    # MAX_CONCURRENCY of them in flight (task -> receipts in it) and top up
+    # as soon as one finishes or a new task is enqueued
+    in_flight: dict[asyncio.Task, int] = {}
+    wake: asyncio.Task | None = None
+    while True:
+        busy = sum(in_flight.values())
+        limit = min(BATCH_SIZE, MAX_CONCURRENCY - busy)
+        rows = []
+        if limit > 0:
+            try:
+                rows = await claim_tasks(limit)
             except Exception as e:
-                db.rollback()
-                mark_failed(db, task_id, attempts, str(e))
-                print(f"[worker] task={task_id} receipt={receipt_id} failed: {e}")
+                print(f"[worker] claim failed: {e}")
+
+        for i in range(0, len(rows), max(OCR_BATCH_SIZE, 1)):
+            group = rows[i:i + max(OCR_BATCH_SIZE, 1)]
+            in_flight[asyncio.create_task(run_group(group))] = len(group)
+
+        # a full batch means more tasks may be ready: claim again if there is room
+        if rows and len(rows) == limit and busy + len(rows) < MAX_CONCURRENCY:
+            continue
+
+        if wake is None or wake.done():
+            wake = asyncio.create_task(task_wakeup.wait_for_new_task(IDLE_POLL_SECONDS))
 
-        finally:
-            db.close()
+        done, _ = await asyncio.wait([*in_flight, wake], return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            if t is wake:
+                continue
+            del in_flight[t]
+            if t.exception() is not None:
+                print(f"[worker] task crashed: {t.exception()}")
+
+
+def main():
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
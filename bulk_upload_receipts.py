@@ -1,18 +1,56 @@
 import argparse
 import os
+import queue
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from itertools import islice
 from pathlib import Path
 
 import requests
-import mimetypes
-
-
-IMG_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
+
+from polling import PollBackoff
+
+
+# must match what the server accepts (_sniff_image_suffix in app/api/receipts.py): one unsupported
+# file makes /upload-bulk reject its whole batch and resend it file by file
+EXT_TO_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+}
+IMG_EXTS = frozenset(EXT_TO_MIME)
+# same extensions without the dot, matched against raw entry names in iter_images
+IMG_EXTS_NO_DOT = frozenset(ext[1:] for ext in IMG_EXTS)
+
+
+def make_session(pool_maxsize: int = 32) -> requests.Session:
+    # pooled keep-alive connections for all calls instead of a new TCP/TLS handshake per request;
+    # pool_maxsize should be >= the number of threads sharing the session. Mount once and never set a
+    # Connection header: either would drop the pooled sockets
+    sess = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_maxsize,
+        pool_block=False,
+        max_retries=Retry(total=3, backoff_factor=0.3),
+    )
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    return sess
 
 
-def register(base_url: str, username: str, password: str) -> None:
+def register(sess: requests.Session, base_url: str, username: str, password: str) -> None:
     url = f"{base_url}/auth/register"
-    r = requests.post(url, json={"username": username, "password": password}, timeout=20)
+    r = sess.post(url, json={"username": username, "password": password}, timeout=20)
     if r.status_code in (200, 201):
         return
     if r.status_code == 400 and "already exists" in r.text.lower():
@@ -20,9 +58,10 @@ def register(base_url: str, username: str, password: str) -> None:
     raise RuntimeError(f"register failed: {r.status_code} {r.text}")
 
 
-def login(base_url: str, username: str, password: str) -> str:
+def login(sess: requests.Session, base_url: str, username: str, password: str) -> str:
+    """Logs in and sets the bearer token as a default header on the session."""
     url = f"{base_url}/auth/login"
-    r = requests.post(
+    r = sess.post(
         url,
         data={"username": username, "password": password},
         headers={"Content-Type": "application/x-www-form-urlencoded"},
@@ -30,61 +69,158 @@ def login(base_url: str, username: str, password: str) -> str:
     )
     if r.status_code != 200:
         raise RuntimeError(f"login failed: {r.status_code} {r.text}")
-    return r.json()["access_token"]
+    token = r.json()["access_token"]
+    sess.headers["Authorization"] = f"Bearer {token}"
+    return token
 
 
-def upload_receipt(base_url: str, token: str, file_path: Path, currency: str = "AUTO") -> dict:
-    url = f"{base_url}/receipts/upload"
-    headers = {"Authorization": f"Bearer {token}"}
+def guess_mime(file_path: Path) -> str:
+    return EXT_TO_MIME.get(file_path.suffix.lower(), "image/jpeg")
 
-    mime, _ = mimetypes.guess_type(str(file_path))
-    mime = (mime or "image/jpeg").lower()
 
-    ext = file_path.suffix.lower()
-    if ext in (".jpg", ".jpeg"):
-        mime = "image/jpeg"
-    elif ext == ".png":
-        mime = "image/png"
-    elif ext == ".webp":
-        mime = "image/webp"
+def post_multipart(sess: requests.Session, url: str, fields: list, timeout: float) -> requests.Response:
+    # streams file bodies from disk instead of building the whole multipart payload in memory
+    encoder = MultipartEncoder(fields=fields)
+    return sess.post(url, data=encoder, headers={"Content-Type": encoder.content_type}, timeout=timeout)
+
+
+def upload_receipt(sess: requests.Session, base_url: str, file_path: Path, currency: str = "AUTO") -> dict:
+    url = f"{base_url}/receipts/upload"
 
     with file_path.open("rb") as f:
-        files = {"file": (file_path.name, f, mime)}
-        data = {"currency": currency}
-        r = requests.post(url, headers=headers, files=files, data=data, timeout=60)
+        fields = [("file", (file_path.name, f, guess_mime(file_path))), ("currency", currency)]
+        r = post_multipart(sess, url, fields, timeout=60)
 
     if r.status_code not in (200, 201):
         raise RuntimeError(f"upload failed: {r.status_code} {r.text}")
     return r.json()
 
 
+def upload_receipts_batch(
+    sess: requests.Session, base_url: str, file_paths: list[Path], currency: str = "AUTO"
+) -> list[dict]:
+    """Uploads several receipts in one multipart request; returns them in the order of file_paths."""
+    url = f"{base_url}/receipts/upload-bulk"
+
+    with ExitStack() as stack:
+        fields = [
+            ("files", (p.name, stack.enter_context(p.open("rb")), guess_mime(p)))
+            for p in file_paths
+        ]
+        fields.append(("currency", currency))
+        r = post_multipart(sess, url, fields, timeout=60 + 10 * len(file_paths))
 
-def get_receipt(base_url: str, token: str, receipt_id: int) -> dict:
-    url = f"{base_url}/receipts/{receipt_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get(url, headers=headers, timeout=20)
+    if r.status_code not in (200, 201):
+        raise RuntimeError(f"bulk upload failed: {r.status_code} {r.text}")
+    return r.json()
+
+
+def get_receipts_bulk(sess: requests.Session, base_url: str, receipt_ids: list[int]) -> list[dict]:
+    """Current state of up to 200 receipts in one request."""
+    url = f"{base_url}/receipts"
+    params = {"ids": ",".join(map(str, receipt_ids)), "limit": len(receipt_ids)}
+    r = sess.get(url, params=params, timeout=20)
     if r.status_code != 200:
-        raise RuntimeError(f"get_receipt failed: {r.status_code} {r.text}")
+        raise RuntimeError(f"get_receipts_bulk failed: {r.status_code} {r.text}")
     return r.json()
 
 
-def wait_receipt_done(base_url: str, token: str, receipt_id: int, timeout_s: int = 300, poll_s: float = 2.0) -> dict:
-    t0 = time.time()
-    last = None
+def upload_chunk(sess: requests.Session, args: argparse.Namespace, imgs: list[Path]) -> list[dict | Exception]:
+    """Uploads imgs (in one request when there are several); one result per image."""
+    resps: list[dict | Exception] | None = None
+    if len(imgs) > 1:
+        try:
+            resps = upload_receipts_batch(sess, args.base_url, imgs, currency=args.currency)
+        except RuntimeError as e:
+            # the server rejects the whole batch if one file is bad: retry file by file
+            print(f"[batch] {e}; retrying {len(imgs)} files one by one")
+
+    if resps is None:
+        resps = []
+        for img in imgs:
+            try:
+                resps.append(upload_receipt(sess, args.base_url, img, currency=args.currency))
+            except Exception as e:
+                resps.append(e)
+
+    return resps
+
+
+def chunked(it, size: int):
+    it = iter(it)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def print_finished(rid: int, img: Path, r: dict) -> None:
+    if r.get("status") == "done":
+        print(
+            f"[done] id={rid} file={img.name} currency={r.get('currency')} "
+            f"detected={r.get('detected_currency')} total_usd={r.get('total_usd')}"
+        )
+    else:
+        print(f"[{r.get('status')}] id={rid} file={img.name} error={r.get('error')}")
+
+
+def wait_receipts_done(
+    sess: requests.Session,
+    base_url: str,
+    uploads: "queue.Queue[list[tuple[int, Path]] | None]",
+    timeout_s: int = 300,
+    poll_s: float = 2.0,
+) -> dict[int, dict]:
+    """
+    Consumes uploaded (id, file) batches from uploads until the None sentinel and polls them together,
+    printing each receipt as it finishes. timeout_s counts from the sentinel. Returns the last state per id.
+    """
+    backoff = PollBackoff(poll_s)
+    last: dict[int, dict] = {}
+    pending: dict[int, Path] = {}
+    deadline = None
     while True:
-        last = get_receipt(base_url, token, receipt_id)
-        st = last.get("status")
-        if st in ("done", "error"):
+        # drain what the uploaders produced so far; block only while there is nothing to poll
+        while deadline is None:
+            try:
+                batch = uploads.get(block=not pending)
+            except queue.Empty:
+                break
+            if batch is None:
+                deadline = time.time() + timeout_s
+            else:
+                pending.update(batch)
+
+        if pending:
+            try:
+                for ids in chunked(sorted(pending), 200):
+                    for r in get_receipts_bulk(sess, base_url, ids):
+                        last[r["id"]] = r
+                        if r.get("status") in ("done", "error"):
+                            print_finished(r["id"], pending.pop(r["id"]), r)
+            except (requests.RequestException, RuntimeError) as e:
+                # keep consuming: a dead poller would block the uploaders on the full queue
+                print(f"[wait] poll failed: {e}")
+
+        if deadline is not None and (not pending or time.time() > deadline):
+            for rid, img in sorted(pending.items()):
+                print(f"[timeout] id={rid} file={img.name} status={last.get(rid, {}).get('status')}")
             return last
-        if time.time() - t0 > timeout_s:
-            return last
-        time.sleep(poll_s)
+        if pending:
+            # back off by the most advanced receipt still pending
+            processing = any(last.get(rid, {}).get("status") == "processing" for rid in pending)
+            backoff.sleep("processing" if processing else "queued")
 
 
-def iter_images(folder: Path):
-    for p in sorted(folder.rglob("*")):
-        if p.is_file() and p.suffix.lower() in IMG_EXTS:
-            yield p
+def iter_images(folder: Path | str):
+    # depth-first, sorted per directory only; Path objects are built just for matching images
+    with os.scandir(folder) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for e in entries:
+        if e.is_dir(follow_symlinks=False):
+            yield from iter_images(e.path)
+            continue
+        _, dot, ext = e.name.rpartition(".")
+        if dot and ext.lower() in IMG_EXTS_NO_DOT and e.is_file():
+            yield Path(e.path)
 
 
 def main():
@@ -96,8 +232,10 @@ def main():
     ap.add_argument("--currency", default="AUTO", help="AUTO recommended. Or USD/EUR/CHF/RUB.")
     ap.add_argument("--limit", type=int, default=0, help="0 = no limit")
     ap.add_argument("--sleep", type=float, default=0.0, help="Sleep between uploads (seconds)")
-    ap.add_argument("--wait", action="store_true", help="Wait for processing (poll /receipts/{id})")
-    ap.add_argument("--timeout", type=int, default=300, help="Wait timeout per receipt (seconds)")
+    ap.add_argument("--workers", type=int, default=4, help="Parallel uploads")
+    ap.add_argument("--batch-size", type=int, default=10, help="Receipts per upload request (1 = one request per file)")
+    ap.add_argument("--wait", action="store_true", help="Wait for processing while uploading (polls /receipts?ids=...)")
+    ap.add_argument("--timeout", type=int, default=300, help="Wait timeout after the last upload (seconds)")
     args = ap.parse_args()
 
     folder = Path(args.folder).expanduser().resolve()
@@ -105,50 +243,87 @@ def main():
         raise SystemExit(f"Folder not found: {folder}")
 
     # Setup session
-    sess = requests.Session()
+    workers = max(args.workers, 1)
+    # +1 for the --wait poller thread sharing the session
+    sess = make_session(pool_maxsize=max(workers + 1, 8))
 
     # Register/login
-    register(args.base_url, args.username, args.password)
-    token = login(args.base_url, args.username, args.password)
+    register(sess, args.base_url, args.username, args.password)
+    login(sess, args.base_url, args.username, args.password)
     print(f"[auth] logged in as {args.username}")
 
     uploaded = []
     failures = 0
 
-    for i, img in enumerate(iter_images(folder), start=1):
-        if args.limit and i > args.limit:
-            break
-
-        try:
-            resp = upload_receipt(args.base_url, token, img, currency=args.currency)
-            rid = int(resp["id"])
-            print(f"[upload] {i:04d} id={rid} file={img.name} status={resp.get('status')} currency_sent={args.currency}")
-            uploaded.append((rid, img))
-
-            if args.wait:
-                done = wait_receipt_done(args.base_url, token, rid, timeout_s=args.timeout, poll_s=2.0)
-                st = done.get("status")
-                cur = done.get("currency")
-                det = done.get("detected_currency")
-                tot_usd = done.get("total_usd")
-                err = done.get("error")
-                if st == "done":
-                    print(f"        -> done currency={cur} detected={det} total_usd={tot_usd}")
-                else:
-                    print(f"        -> {st} error={err}")
-
-        except Exception as e:
-            failures += 1
-            print(f"[ERROR] file={img} err={e}")
-
-        if args.sleep > 0:
-            time.sleep(args.sleep)
+    # with --wait a poller thread tracks receipts while the rest are still uploading;
+    # the bounded queue holds back uploads if polling falls behind
+    uploads: queue.Queue = queue.Queue(maxsize=workers * 4)
+    finished: dict[int, dict] = {}
+    poller = None
+    if args.wait:
+        poller = threading.Thread(
+            target=lambda: finished.update(
+                wait_receipts_done(sess, args.base_url, uploads, timeout_s=args.timeout, poll_s=2.0)
+            ),
+            daemon=True,
+        )
+        poller.start()
+
+    def collect(block: bool) -> None:
+        # handles finished uploads right away, so the poller sees them while later chunks still upload
+        nonlocal failures
+        if block:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        else:
+            done = [f for f in futures if f.done()]
+
+        for fut in done:
+            chunk = futures.pop(fut)
+            try:
+                resps = fut.result()
+            except Exception as e:
+                resps = [e] * len(chunk)
+
+            batch = []
+            for (i, img), resp in zip(chunk, resps):
+                if isinstance(resp, Exception):
+                    failures += 1
+                    print(f"[ERROR] file={img} err={resp}")
+                    continue
+
+                rid = int(resp["id"])
+                print(f"[upload] {i:04d} id={rid} file={img.name} status={resp.get('status')} currency_sent={args.currency}")
+                batch.append((rid, img))
+            uploaded.extend(batch)
+            if poller and batch:
+                uploads.put(batch)
+
+    images = enumerate(islice(iter_images(folder), args.limit or None), start=1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for chunk in chunked(images, max(args.batch_size, 1)):
+            # at most 2 chunks per worker in flight
+            collect(block=len(futures) >= workers * 2)
+            futures[pool.submit(upload_chunk, sess, args, [img for _, img in chunk])] = chunk
+            if args.sleep > 0:
+                time.sleep(args.sleep)
+
+        while futures:
+            collect(block=True)
+
+    if poller:
+        uploads.put(None)
+        poller.join()
 
     print("\n=== SUMMARY ===")
     print(f"uploaded: {len(uploaded)}")
     print(f"failures: {failures}")
+    if args.wait:
+        statuses = [finished.get(rid, {}).get("status") for rid, _ in uploaded]
+        print(f"done: {statuses.count('done')}, error: {statuses.count('error')}, "
+              f"unfinished: {len(statuses) - statuses.count('done') - statuses.count('error')}")
     if not args.wait and uploaded:
-        print("first 10 receipt_ids:", [rid for rid, _ in uploaded[:10]])
+        print("first 10 receipt_ids:", sorted(rid for rid, _ in uploaded)[:10])
 
 
 if __name__ == "__main__":
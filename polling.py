@@ -0,0 +1,22 @@
+import random
+import time
+
+
+class PollBackoff:
+    """
+    Poll delay for the client scripts:
+    - starts at start_s and grows x1.5 per poll up to cap_s
+    - while the receipt is still queued it grows x2 (the worker hasn't picked it up yet)
+    - once it is processing it stays at cap_s (OCR + LLM take seconds anyway)
+    - +-10% jitter so many waiting clients don't poll in lockstep
+    """
+
+    def __init__(self, cap_s: float, start_s: float = 0.25) -> None:
+        self.cap_s = cap_s
+        self.delay = min(start_s, cap_s)
+
+    def sleep(self, status: str | None) -> None:
+        if status == "processing":
+            self.delay = self.cap_s
+        time.sleep(self.delay * random.uniform(0.9, 1.1))
+        self.delay = min(self.cap_s, self.delay * (2.0 if status == "queued" else 1.5))
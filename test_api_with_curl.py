@@ -1,25 +1,23 @@
 import argparse
 import json
-import os
-import subprocess
+import mimetypes
 import sys
 import time
 from pathlib import Path
 
+import requests
 
-def run_curl(args_list: list[str]) -> str:
-    curl_bin = "curl.exe" if os.name == "nt" else "curl"
+from polling import PollBackoff
 
-    cmd = [curl_bin, "-sS"] + args_list
-    p = subprocess.run(cmd, capture_output=True, text=True)
 
-    if p.returncode != 0:
-        print("\n[curl error] command:", " ".join(cmd))
-        print("[stdout]:", p.stdout)
-        print("[stderr]:", p.stderr)
-        raise SystemExit(p.returncode)
-
-    return p.stdout.strip()
+def api_call(sess: requests.Session, method: str, url: str, **kwargs) -> str:
+    # one keep-alive connection for the whole run instead of a curl process per call
+    try:
+        resp = sess.request(method, url, timeout=60, **kwargs)
+    except requests.RequestException as e:
+        print(f"\n[request error] {method} {url}: {e}")
+        raise SystemExit(1)
+    return resp.text.strip()
 
 
 def try_parse_json(s: str):
@@ -29,15 +27,11 @@ def try_parse_json(s: str):
         return None
 
 
-def register(base_url: str, username: str, password: str) -> None:
+def register(sess: requests.Session, base_url: str, username: str, password: str) -> None:
     url = f"{base_url}/auth/register"
     payload = {"username": username, "password": password}
 
-    out = run_curl([
-        "-X", "POST", url,
-        "-H", "Content-Type: application/json",
-        "-d", json.dumps(payload),
-    ])
+    out = api_call(sess, "POST", url, json=payload)
     js = try_parse_json(out)
 
     if js and isinstance(js, dict) and js.get("detail") == "Username already exists":
@@ -54,37 +48,34 @@ def register(base_url: str, username: str, password: str) -> None:
         print("[register] response:", js)
 
 
-def login(base_url: str, username: str, password: str) -> str:
+def login(sess: requests.Session, base_url: str, username: str, password: str) -> str:
     url = f"{base_url}/auth/login"
 
-    out = run_curl([
-        "-X", "POST", url,
-        "-H", "Content-Type: application/x-www-form-urlencoded",
-        "--data-urlencode", f"username={username}",
-        "--data-urlencode", f"password={password}",
-    ])
+    out = api_call(sess, "POST", url, data={"username": username, "password": password})
     js = try_parse_json(out)
     if not js or "access_token" not in js:
         print("[login] unexpected response:", out)
         raise SystemExit(1)
 
     token = js["access_token"]
+    sess.headers["Authorization"] = f"Bearer {token}"
     print("[login] ok token_len=", len(token))
     return token
 
 
-def upload_receipt(base_url: str, token: str, image_path: str) -> dict:
+def upload_receipt(sess: requests.Session, base_url: str, image_path: str) -> dict:
     url = f"{base_url}/receipts/upload"
 
     img = Path(image_path).expanduser().resolve()
     if not img.exists():
         raise SystemExit(f"Image not found: {img}")
 
-    out = run_curl([
-        "-X", "POST", url,
-        "-H", f"Authorization: Bearer {token}",
-        "-F", f"file=@{str(img)}",
-    ])
+    mime = mimetypes.guess_type(img.name)[0] or "application/octet-stream"
+    with img.open("rb") as f:
+        out = api_call(
+            sess, "POST", url,
+            files={"file": (img.name, f, mime)},
+        )
     js = try_parse_json(out)
     if not js or "id" not in js:
         print("[upload] unexpected response:", out)
@@ -94,12 +85,9 @@ def upload_receipt(base_url: str, token: str, image_path: str) -> dict:
     return js
 
 
-def reprocess_receipt(base_url: str, token: str, receipt_id: int) -> dict:
+def reprocess_receipt(sess: requests.Session, base_url: str, receipt_id: int) -> dict:
     url = f"{base_url}/receipts/{receipt_id}/reprocess"
-    out = run_curl([
-        "-X", "POST", url,
-        "-H", f"Authorization: Bearer {token}",
-    ])
+    out = api_call(sess, "POST", url)
     js = try_parse_json(out)
     if not js or "id" not in js:
         print("[reprocess] unexpected response:", out)
@@ -109,12 +97,9 @@ def reprocess_receipt(base_url: str, token: str, receipt_id: int) -> dict:
     return js
 
 
-def get_receipt(base_url: str, token: str, receipt_id: int) -> dict:
+def get_receipt(sess: requests.Session, base_url: str, receipt_id: int) -> dict:
     url = f"{base_url}/receipts/{receipt_id}"
-    out = run_curl([
-        "-X", "GET", url,
-        "-H", f"Authorization: Bearer {token}",
-    ])
+    out = api_call(sess, "GET", url)
     js = try_parse_json(out)
     if js is None:
         print("[get_receipt] non-json response:", out)
@@ -122,70 +107,77 @@ def get_receipt(base_url: str, token: str, receipt_id: int) -> dict:
     return js
 
 
-def get_task(base_url: str, token: str, receipt_id: int) -> dict:
+def get_task(sess: requests.Session, base_url: str, receipt_id: int) -> dict:
     url = f"{base_url}/receipts/{receipt_id}/task"
-    out = run_curl([
-        "-X", "GET", url,
-        "-H", f"Authorization: Bearer {token}",
-    ])
+    out = api_call(sess, "GET", url)
     js = try_parse_json(out)
     return js if js is not None else {"raw": out}
 
 
 def poll_until_finished(
+    sess: requests.Session,
     base_url: str,
-    token: str,
     receipt_id: int,
     timeout_s: int,
     interval_s: float,
     show_task: bool,
 ) -> dict:
     start = time.time()
+    backoff = PollBackoff(interval_s)
+    prefix = f"[poll] receipt_id={receipt_id} status="
+    out = sys.stdout
+    lines = 0
     last = None
 
     while True:
-        r = get_receipt(base_url, token, receipt_id)
+        r = get_receipt(sess, base_url, receipt_id)
         last = r
         status = r.get("status")
 
         merchant = r.get("merchant")
         total = r.get("total")
-        currency = r.get("currency")
-
-        extra = []
-        if merchant:
-            extra.append(f"merchant={merchant}")
-        if total is not None:
-            extra.append(f"total={total}{currency or ''}")
-
-        extra_str = (" | " + ", ".join(extra)) if extra else ""
-        print(f"[poll] receipt_id={receipt_id} status={status}{extra_str}")
+        extra_str = ""
+        if merchant or total is not None:
+            extra = []
+            if merchant:
+                extra.append(f"merchant={merchant}")
+            if total is not None:
+                extra.append(f"total={total}{r.get('currency') or ''}")
+            extra_str = " | " + ", ".join(extra)
+        out.write(f"{prefix}{status}{extra_str}\n")
 
         if show_task:
-            t = get_task(base_url, token, receipt_id)
+            t = get_task(sess, base_url, receipt_id)
             task = (t.get("task") or {}) if isinstance(t, dict) else {}
             if task:
-                print(
+                out.write(
                     "       "
                     f"task_status={task.get('status')} "
                     f"attempts={task.get('attempts')} "
                     f"receipt_version={task.get('receipt_version')} "
-                    f"locked_by={task.get('locked_by')}"
+                    f"locked_by={task.get('locked_by')}\n"
                 )
             else:
                 rv = t.get("receipt_version") if isinstance(t, dict) else None
-                print(f"       task=None receipt_version={rv}")
+                out.write(f"       task=None receipt_version={rv}\n")
+
+        # flush in batches; always before returning so the poll lines precede the result
+        lines += 1
+        if lines % 10 == 0:
+            out.flush()
 
         if status in ("done", "error"):
+            out.flush()
             print("[poll] finished.")
             return r
 
         if time.time() - start > timeout_s:
+            out.flush()
             print("[poll] timeout reached.")
             print(json.dumps(last, ensure_ascii=False, indent=2))
             return last
 
-        time.sleep(interval_s)
+        backoff.sleep(status)
 
 
 def main():
@@ -195,28 +187,30 @@ def main():
     ap.add_argument("--password", default="secret123", help="Password")
     ap.add_argument("--image", required=True, help="Path to receipt image, e.g. C:\\path\\to\\receipt.jpg")
     ap.add_argument("--timeout", type=int, default=120, help="Polling timeout seconds")
-    ap.add_argument("--interval", type=float, default=2.0, help="Polling interval seconds")
+    ap.add_argument("--interval", type=float, default=2.0, help="Max polling interval seconds (polls start at 0.25s)")
     ap.add_argument("--show-task", action="store_true", help="Also call /receipts/{id}/task during polling")
 
     ap.add_argument("--reprocess-times", type=int, default=1, help="How many times to call /reprocess after first done (0 disables)")
 
     args = ap.parse_args()
 
-    print("== Receipt API smoke test via curl ==")
+    print("== Receipt API smoke test ==")
     print("NOTE: worker должен быть запущен: python -m app.worker\n")
 
-    register(args.base_url, args.username, args.password)
-    token = login(args.base_url, args.username, args.password)
+    sess = requests.Session()
+
+    register(sess, args.base_url, args.username, args.password)
+    login(sess, args.base_url, args.username, args.password)
 
-    receipt = upload_receipt(args.base_url, token, args.image)
+    receipt = upload_receipt(sess, args.base_url, args.image)
     receipt_id = int(receipt["id"])
 
-    r1 = poll_until_finished(args.base_url, token, receipt_id, args.timeout, args.interval, args.show_task)
+    r1 = poll_until_finished(sess, args.base_url, receipt_id, args.timeout, args.interval, args.show_task)
 
     for i in range(max(0, args.reprocess_times)):
         print(f"\n== REPROCESS #{i+1}/{args.reprocess_times} ==")
-        reprocess_receipt(args.base_url, token, receipt_id)
-        rN = poll_until_finished(args.base_url, token, receipt_id, args.timeout, args.interval, args.show_task)
+        reprocess_receipt(sess, args.base_url, receipt_id)
+        rN = poll_until_finished(sess, args.base_url, receipt_id, args.timeout, args.interval, args.show_task)
 
         if rN.get("status") == "done":
             print("[reprocess] done. extracted fields present:",